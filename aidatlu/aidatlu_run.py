@@ -57,6 +57,9 @@ class AIDATLU:
     def stop(self):
         self.aidatlu.stop_run()
 
+    def close(self):
+        self.aidatlu.close()
+
     def configure(self):
         self.ready = True
         self.init()
@@ -77,12 +80,20 @@ class AIDATLU:
             )
             hw = uhal.HwInterface(manager.getDevice("aida_tlu.controlhub"))
 
-        self.aidatlu = AidaTLU(hw, conf_dict, self.clock_file, i2c=I2CMETHOD)
+        self.aidatlu = AidaTLU(
+            hw,
+            conf_dict,
+            self.clock_file,
+            i2c=I2CMETHOD,
+            online_interpretation=conf_dict["online_interpretation"],
+            interpretation_workers=conf_dict["interpretation_workers"],
+        )
 
     def help(self):
         print("tlu.configure()")
         print("start run: tlu.run()")
         print("stop  run: ctr+c")
+        print("finish interpretation: tlu.close()")
         print("exit:      ctr+d/exit()\n")
         print("for access to the main tlu functions: tlu.aidatlu....")
 
@@ -103,7 +114,10 @@ def start():
     logger.setup_main_logger(name="AIDA-TLU", level="INFO")
     tlu = AIDATLU(config_path, clock_path)
     tlu.configure()
-    tlu.run()
+    try:
+        tlu.run()
+    finally:
+        tlu.close()
 
 
 if __name__ == "__main__":
@@ -1,4 +1,3 @@
-from collections import deque
 from enum import StrEnum
 import os
 import threading
@@ -17,7 +16,15 @@ from constellation.core.commandmanager import cscp_requestable
 
 from aidatlu.hardware.i2c import I2CCore
 from aidatlu.main.config_parser import toml_parser
-from aidatlu.hardware.tlu_controller import TLUControl, TLUConfigure
+from aidatlu.main.readout import (
+    EventBatcher,
+    EventFramer,
+    PollScheduler,
+    StatusSampler,
+    batch_metadata,
+    event_blocks,
+)
+from aidatlu.hardware.tlu_controller import TLUControl, TLUConfigure, TLUStatus
 from aidatlu.test.utils import MockI2C
 
 
@@ -58,6 +65,10 @@ class AidaTLU(TransmitterSatellite):
             self.hw = None
 
         self._init_tlu(configuration)
+        # All counters are read in one batched read, metrics use the cached sample
+        self.status_sampler = StatusSampler(
+            self.tlu_controller.get_status, max_age=self.status_interval
+        )
         self.tlu_configure.configure()
         self.tlu_controller.get_event_fifo_fill_level()
         self.tlu_controller.get_event_fifo_csr()
@@ -72,6 +83,7 @@ class AidaTLU(TransmitterSatellite):
         self.tlu_controller.get_event_fifo_csr()
         self.tlu_controller.reset_counters()
         self.tlu_controller.get_scalers()
+        self.status_sampler.invalidate()
         return "Do launching complete"
 
     def do_landing(self) -> str:
@@ -79,21 +91,12 @@ class AidaTLU(TransmitterSatellite):
 
     def do_starting(self, run_identifier: str = None) -> str:
         if self.use_mock:
-            start_time = time.time()
-
-            def _get_timestamp(self):
-                # Helper function returns timestamp
-                return (time.time() - start_time) / 25 * 1000000000
 
             def _pull_fifo_event(self):
                 # Blank FIFO pull helper function
                 return 0
 
-            # Overwrite TLU methods needed for run loop
-            func_type = type(self.tlu_controller.get_timestamp)
-            self.tlu_controller.get_timestamp = func_type(
-                _get_timestamp, self.tlu_controller
-            )
+            # Overwrite TLU methods needed for run loop, the mock timestamp runs during a run
             func_type = type(self.tlu_controller.pull_fifo_event)
             self.tlu_controller.pull_fifo_event = func_type(
                 _pull_fifo_event, self.tlu_controller
@@ -103,14 +106,11 @@ class AidaTLU(TransmitterSatellite):
         self.tlu_controller.get_fw_version()
         self.tlu_controller.get_device_id()
         # reset starting parameter
-        self.start_time = self.tlu_controller.get_timestamp()
+        status = self.status_sampler.sample()
+        self.start_time = status.timestamp
         self.last_time = 0
-        self.last_post_veto_trigger = (
-            self.tlu_controller.trigger_logic.get_post_veto_trigger()
-        )
-        self.last_pre_veto_trigger = (
-            self.tlu_controller.trigger_logic.get_pre_veto_trigger()
-        )
+        self.last_post_veto_trigger = status.post_veto_triggers
+        self.last_pre_veto_trigger = status.pre_veto_triggers
         self._pre_veto_rate = 0.0
         self._post_veto_rate = 0.0
 
@@ -127,24 +127,44 @@ class AidaTLU(TransmitterSatellite):
         t = threading.Thread(target=self.handle_status)
         t.start()
 
-        # We ideally pull 6 uint32s, but we might pull more or less
-        # Thus, add data to a queue and pop in blocks of 6 uint32s
-        data_queue = deque()
+        # We ideally pull multiples of 6 uint32s, but we might pull more or less
+        # Thus, the framer keeps incomplete events until the next poll
+        self.framer = EventFramer()
+        self.poll_scheduler.reset()
+        self.batcher.reset()
         while not self.stop_requested():
-            evt = self.tlu_controller.pull_fifo_event()
-            if np.size(evt) > 1:
-                data_queue.extend(evt)
-                while len(data_queue) >= 6:
-                    self._handle_event([data_queue.popleft() for _ in range(6)])
+            self._poll_fifo()
+            self.batcher.flush()
+            interval = self.poll_scheduler.update(self.tlu_controller.fifo_fill_level)
+            if interval:
+                time.sleep(interval)
+        self.poll_scheduler.log_report()
 
         setattr(t, "do_run", False)
         return "Do running complete"
 
     def do_stopping(self) -> str:
         self.tlu_controller.stop_run()
-        self.tlu_controller.pull_fifo_event()
+        # Each read also updates the fill level for the next one,
+        # the FIFO is empty after two consecutive reads without data.
+        n_empty = 0
+        while n_empty < 2:
+            n_empty = 0 if self._poll_fifo() else n_empty + 1
+        self.batcher.flush(force=True)
         return "Do running complete"
 
+    def _poll_fifo(self) -> bool:
+        """Reads the FIFO and passes the framed events to the batcher.
+
+        Returns:
+            bool: True if words were read from the FIFO.
+        """
+        evt = self.tlu_controller.pull_fifo_event()
+        if np.size(evt) > 1:
+            self.batcher.add(self.framer.frame(evt))
+            return True
+        return False
+
     def _read_config(self, config: Configuration) -> dict[str, Any]:
         "Reads and checks Constellation configuration"
         config.set_default(
@@ -157,6 +177,13 @@ class AidaTLU(TransmitterSatellite):
         config.set_default(key="internal_trigger_rate", value=0)
         config.set_default(key="enable_clock_lemo_output", value=False)
         config.set_default(key="status_interval", value=1.0)
+        config.set_default(key="shadow_cache", value=False)
+        config.set_default(key="warm_start", value=False)
+        config.set_default(key="poll_min_interval", value=0.0)
+        config.set_default(key="poll_max_interval", value=0.01)
+        config.set_default(key="poll_watermark", value=8000)
+        config.set_default(key="batch_size", value=1)
+        config.set_default(key="batch_timeout", value=100.0)
         config.set_default(
             key="trigger_polarity",
             value=["falling", "falling", "falling", "falling", "falling", "falling"],
@@ -190,6 +217,19 @@ class AidaTLU(TransmitterSatellite):
 
         self.status_interval = config.get_float("status_interval")
         self.log.debug("Calculating status every %.3f s" % self.status_interval)
+        self.shadow_cache = config.get("shadow_cache")
+        self.warm_start = config.get("warm_start")
+        self.poll_scheduler = PollScheduler(
+            min_interval=config.get_float("poll_min_interval"),
+            max_interval=config.get_float("poll_max_interval"),
+            watermark=config.get_int("poll_watermark"),
+        )
+        # Batch timeout is configured in milliseconds
+        self.batcher = EventBatcher(
+            self._send_events,
+            batch_size=config.get_int("batch_size"),
+            batch_timeout=config.get_float("batch_timeout") / 1000,
+        )
 
         return configuration
 
@@ -197,26 +237,28 @@ class AidaTLU(TransmitterSatellite):
         "Parse configuration file to TLU and initialize, set loggers"
         self.tlu_config = toml_parser(config, constellation=True)
         self.clock_file = config["clock_config"]
-        self.tlu_controller = TLUControl(self.hw, i2c=self.i2c_method)
-        self.tlu_controller.write_clock_config(self.clock_file)
+        self.tlu_controller = TLUControl(
+            self.hw, i2c=self.i2c_method, shadow_cache=self.shadow_cache
+        )
+        self.tlu_controller.write_clock_config(
+            self.clock_file, warm_start=self.warm_start
+        )
 
         self.tlu_configure = TLUConfigure(self.tlu_controller, self.tlu_config)
         self.tlu_controller.reset_configuration()
 
-    def _handle_event(self, evt: list) -> None:
-        # Calculate timestamp in nanoseconds from TLU 40MHz clock:
-        timestamp = 25 * (((np.uint64(evt[0]) & 0x0000FFFF) << 32) + evt[1])
-        # Collect metadata
-        meta = {
-            "flag_trigger": True,
-            "trigger_number": int(evt[3]),
-            "timestamp_begin": int(timestamp * 1000),
-            "timestamp_end": int((timestamp + 25) * 1000),
-        }
+    def _send_events(self, events: np.ndarray) -> None:
+        """Sends events in one data record. Each event is a separate block of the record,
+        so the record stays compatible with writing blocks as individual events.
+        The metadata holds the trigger number and timestamp of each block.
+
+        Args:
+            events (np.ndarray): Events of shape (N, 6).
+        """
+        data_record = self.new_data_record(batch_metadata(events))
         # New data format: store 6 uint32 as bytes in little-endian
-        payload = np.array(evt, dtype="<u4").tobytes()
-        data_record = self.new_data_record(meta)
-        data_record.add_block(payload)
+        for block in event_blocks(events):
+            data_record.add_block(block)
         self.send_data_record(data_record)
 
     def handle_status(self) -> None:
@@ -224,11 +266,12 @@ class AidaTLU(TransmitterSatellite):
         t = threading.current_thread()
         while getattr(t, "do_run", True):
             time.sleep(0.5)
-            last_time = self.tlu_controller.get_timestamp()
-            current_time = (last_time - self.start_time) * 25 / 1000000000
+            # Refreshes the sample used by the metrics
+            status = self.status_sampler.sample()
+            current_time = (status.timestamp - self.start_time) * 25 / 1000000000
             # Calculate and poss. sends status every self.status_interval seconds.
             if current_time - self.last_time > self.status_interval:
-                self.check_status(current_time)
+                self.check_status(current_time, status)
                 self.log.debug(
                     "Run time: %.1f s, Pre veto: %s, Post veto: %s, Pre veto rate: %.f Hz, Post veto rate.: %.f Hz"
                     % (
@@ -240,31 +283,29 @@ class AidaTLU(TransmitterSatellite):
                     )
                 )
 
-    def check_status(self, time: int) -> None:
+    def check_status(self, time: int, status: TLUStatus) -> None:
         """Calculates operation status of the TLU run with runtime, pre- and post-veto numbers/rates.
            Also calculates the mean trigger frequency between function calls.
 
         Args:
             time (int): current runtime of the TLU
+            status (TLUStatus): Sample of the TLU counters.
         """
         self._post_veto_rate = (
-            self.tlu_controller.get_post_veto_trigger_number()
-            - self.last_post_veto_trigger
+            status.post_veto_triggers - self.last_post_veto_trigger
         ) / (time - self.last_time)
         self._pre_veto_rate = (
-            self.tlu_controller.get_pre_veto_trigger_number()
-            - self.last_pre_veto_trigger
+            status.pre_veto_triggers - self.last_pre_veto_trigger
         ) / (time - self.last_time)
         self.run_time = time
-        self.total_post_veto = self.tlu_controller.get_post_veto_trigger_number()
-        self.total_pre_veto = self.tlu_controller.get_pre_veto_trigger_number()
-        s0, s1, s2, s3, s4, s5 = self.tlu_controller.get_scalers()
+        self.total_post_veto = status.post_veto_triggers
+        self.total_pre_veto = status.pre_veto_triggers
 
         self.last_time = time
-        self.last_post_veto_trigger = self.tlu_controller.get_post_veto_trigger_number()
-        self.last_pre_veto_trigger = self.tlu_controller.get_pre_veto_trigger_number()
+        self.last_post_veto_trigger = status.post_veto_triggers
+        self.last_pre_veto_trigger = status.pre_veto_triggers
 
-        if self.tlu_controller.get_event_fifo_csr() == 0x10:
+        if status.fifo_csr == 0x10:
             self.log.warning("FIFO is full")
 
     @cscp_requestable([SatelliteState.ORBIT])
@@ -277,6 +318,7 @@ class AidaTLU(TransmitterSatellite):
         self.tlu_controller.get_event_fifo_csr()
         self.tlu_controller.reset_counters()
         self.tlu_controller.get_scalers()
+        self.status_sampler.invalidate()
         return "Counters reset", None, {}
 
     @schedule_metric("Hz", 1, [SatelliteState.RUN])
@@ -289,32 +331,32 @@ class AidaTLU(TransmitterSatellite):
 
     @schedule_metric("", 1, [SatelliteState.RUN])
     def post_veto(self) -> int:
-        return self.tlu_controller.get_post_veto_trigger_number()
+        return self.status_sampler.get().post_veto_triggers
 
     @schedule_metric("", 1, [SatelliteState.RUN])
     def pre_veto(self) -> int:
-        return self.tlu_controller.get_pre_veto_trigger_number()
+        return self.status_sampler.get().pre_veto_triggers
 
     @schedule_metric("", 1, [SatelliteState.ORBIT, SatelliteState.RUN])
     def sc1(self) -> int:
-        return self.tlu_controller.get_scaler(0)
+        return self.status_sampler.get().scalers[0]
 
     @schedule_metric("", 1, [SatelliteState.ORBIT, SatelliteState.RUN])
     def sc2(self) -> int:
-        return self.tlu_controller.get_scaler(1)
+        return self.status_sampler.get().scalers[1]
 
     @schedule_metric("", 1, [SatelliteState.ORBIT, SatelliteState.RUN])
     def sc3(self) -> int:
-        return self.tlu_controller.get_scaler(2)
+        return self.status_sampler.get().scalers[2]
 
     @schedule_metric("", 1, [SatelliteState.ORBIT, SatelliteState.RUN])
     def sc4(self) -> int:
-        return self.tlu_controller.get_scaler(3)
+        return self.status_sampler.get().scalers[3]
 
     @schedule_metric("", 1, [SatelliteState.ORBIT, SatelliteState.RUN])
     def sc5(self) -> int:
-        return self.tlu_controller.get_scaler(4)
+        return self.status_sampler.get().scalers[4]
 
     @schedule_metric("", 1, [SatelliteState.ORBIT, SatelliteState.RUN])
     def sc6(self) -> int:
-        return self.tlu_controller.get_scaler(5)
+        return self.status_sampler.get().scalers[5]
@@ -1,7 +1,12 @@
+import time
+
 from aidatlu import logger
 from aidatlu.hardware.i2c import I2CCore
 from aidatlu.hardware.ioexpander_controller import IOControl
 
+# Pre- and postamble registers of the configuration file, these are always written
+control_registers = (0x0B24, 0x0B25, 0x0540, 0x0514, 0x001C)
+
 
 class ClockControl:
     """The control class for the Si5344 clock chip.
@@ -13,6 +18,10 @@ class ClockControl:
         self.log.info("Initializing Clock Chip")
         self.i2c = i2c
         self.io_control = io_control
+        # Delay in seconds after the preamble, before the configuration is written
+        self.preamble_delay = 0.3
+        # Locally tracked address page, None if unknown
+        self._page = None
 
     def get_device_version(self) -> int:
         """Get Chip information.
@@ -48,6 +57,42 @@ class ClockControl:
             words = [hex(words[i]) for i in range(n_words)]
         return words
 
+    def is_configured(self, file_path: str) -> bool:
+        """Checks if the chip already holds the clock configuration. The design ID and
+           all configuration registers (without pre- and postamble) are compared.
+
+        Args:
+            file_path (str): File path to the clock configuration file.
+
+        Returns:
+            bool: True if the chip holds the configuration.
+        """
+        rows = {
+            int(row[0], 16) & 0xFFFF: int(row[1], 16) & 0xFF
+            for row in self.parse_clock_conf(file_path)
+            if int(row[0], 16) & 0xFFFF not in control_registers
+        }
+        design_id = [rows.get(0x026B + i) for i in range(8)]
+        if self.check_design_id() != design_id:
+            self.log.info("Clock design ID does not match the configuration")
+            return False
+
+        self._page = self._get_page()
+        chip_rows = {
+            address: self._read_clock_register_tracked(address) & 0xFF
+            for address in rows
+        }
+        if chip_rows != rows:
+            address = next(
+                address for address in rows if chip_rows[address] != rows[address]
+            )
+            self.log.info(
+                "Clock registers do not match the configuration, register %s holds %s instead of %s"
+                % (hex(address), hex(chip_rows[address]), hex(rows[address]))
+            )
+            return False
+        return True
+
     def read_clock_register(self, address: int) -> int:
         """Reads register of the clock chip.
 
@@ -98,24 +143,119 @@ class ClockControl:
             ]
         return contents
 
-    def write_clock_conf(self, file_path: str) -> None:
-        """Writes clock configuration consecutivly in register. This takes a few seconds.
+    def write_clock_conf(self, file_path: str, skip_unchanged: bool = False) -> None:
+        """Writes clock configuration in register. Rows with consecutive addresses
+           on the same page are written as auto-increment bursts.
 
         Args:
             file_path (str): File path to the clock configuration file.
+            skip_unchanged (bool, optional): Read back the registers first and skip the ones
+                already holding the requested value. Pre- and postamble registers are always written.
+                Defaults to False.
         """
-        clock_conf = self.parse_clock_conf(file_path)
+        rows = [
+            (int(row[0], 16) & 0xFFFF, int(row[1], 16) & 0xFF)
+            for row in self.parse_clock_conf(file_path)
+        ]
         self.log.info("Writing clock configuration")
         self.io_control.all_on("r")
-        for index, row in enumerate(clock_conf):
-            self.write_clock_register(int(row[0], 16), int(row[1], 16))
+        self._page = self._get_page()
+
+        # The leading control register writes (preamble) are followed by a delay
+        n_preamble = 0
+        while n_preamble < len(rows) and rows[n_preamble][0] in control_registers:
+            n_preamble += 1
+        preamble = self._compile_bursts(rows[:n_preamble])
+        configuration = self._compile_bursts(rows[n_preamble:], skip_unchanged)
+
+        for address, data in preamble:
+            self._write_clock_burst(address, data)
+        if preamble:
+            time.sleep(self.preamble_delay)
+
+        n_written = 0
+        n_rows = sum(len(data) for _, data in configuration)
+        for address, data in configuration:
+            self._write_clock_burst(address, data)
+            n_written += len(data)
             # This is just fancy, show progress of clock configuration with LEDs.
-            if index % 10 == 0 and int((index / len(clock_conf) * 10 + 1)) != 5:
-                self.io_control.switch_led(int((index / len(clock_conf) * 10 + 1)), "b")
+            led_id = int(n_written / n_rows * 10 + 1)
+            if led_id != 5 and led_id <= 10:
+                self.io_control.switch_led(led_id, "b")
 
         self.log.success("Done writing clock configuration ")
+        self.log.debug(
+            "Wrote %i of %i clock registers in %i bursts"
+            % (
+                n_preamble + n_rows,
+                len(rows),
+                len(preamble) + len(configuration),
+            )
+        )
+        self.log.debug(
+            "I2C command wait statistics: %s" % dict(self.i2c.wait_statistics)
+        )
         self.io_control.all_off()
 
+    def _compile_bursts(self, rows: list, skip_unchanged: bool = False) -> list:
+        """Groups configuration rows into bursts of consecutive addresses on the same page.
+        The order of the rows is kept.
+
+        Args:
+            rows (list): List of (address, data) tuples.
+            skip_unchanged (bool, optional): Skip registers already holding the requested value. Defaults to False.
+
+        Returns:
+            list: List of (start address, data bytes) bursts.
+        """
+        bursts = []
+        next_address = None
+        for address, data in rows:
+            if (
+                skip_unchanged
+                and address not in control_registers
+                and self._read_clock_register_tracked(address) == data
+            ):
+                next_address = None
+                continue
+            if address == next_address and address & 0xFF != 0:
+                bursts[-1][1].append(data)
+            else:
+                bursts.append((address, [data]))
+            next_address = address + 1
+        return bursts
+
+    def _write_clock_burst(self, address: int, data: list) -> None:
+        """Writes data to consecutive registers of the clock chip using the register auto-increment.
+
+        Args:
+            address (int): Start address of the burst.
+            data (list): Data bytes.
+        """
+        self._set_tracked_page((address & 0xFF00) >> 8)
+        self.i2c.write_array(self.i2c.modules["clk"], address & 0xFF, data)
+
+    def _read_clock_register_tracked(self, address: int) -> int:
+        """Reads register of the clock chip using the locally tracked page.
+
+        Args:
+            address (int): Address of the register.
+
+        Returns:
+            int: Integer from the register address.
+        """
+        self._set_tracked_page((address & 0xFF00) >> 8)
+        return self.i2c.read(self.i2c.modules["clk"], address & 0xFF)
+
+    def _set_tracked_page(self, page: int) -> None:
+        """Sets the address page, if it differs from the locally tracked page.
+
+        Args:
+            page (int): Address page.
+        """
+        if page != self._page:
+            self._set_page(page)
+
     def _set_page(self, page: int) -> None:
         """Configures chip to perform operations on specific address page.
 
@@ -123,6 +263,7 @@ class ClockControl:
             page (int): Address page.
         """
         self.i2c.write(self.i2c.modules["clk"], 0x01, page)
+        self._page = page
 
     def _get_page(self) -> int:
         """Get the current address page.
@@ -130,4 +271,5 @@ class ClockControl:
         Returns:
             int: Current address page
         """
-        return self.i2c.read(self.i2c.modules["clk"], 0x01)
+        self._page = self.i2c.read(self.i2c.modules["clk"], 0x01)
+        return self._page
@@ -1,7 +1,19 @@
+import json
+import threading
 import time
+from collections import Counter
+from contextlib import contextmanager
 from math import ceil
 
+import numpy as np
+
 from aidatlu import logger
+from aidatlu.hardware.register_map import (
+    CONNECTION_FILE,
+    RegisterMap,
+    address_table,
+    connection_address_table,
+)
 
 i2c_addr = {
     "core": 0x21,
@@ -18,15 +30,149 @@ i2c_addr = {
     "display": 0x3A,  # Display
 }
 
+# Clock of the I2C master and the shortest time of a single IPbus word access. Both are used to
+# estimate how many status samples cover one I2C command in a pipelined transfer.
+i2c_core_clock = 31.25e6
+ipbus_word_time = 32e-9
+
+# Reverse lookup of the I2C device names
+i2c_modules = {addr: name for name, addr in i2c_addr.items()}
+
+# Registers which change without being written, these are never served from the shadow cache.
+# Entries are register names without the trailing R/W or complete node groups.
+volatile_registers = (
+    "i2c_master",
+    "eventBuffer",
+    "version",
+    "Event_Formatter.ResetTimestamp",
+    "Event_Formatter.CurrentTimestampL",
+    "Event_Formatter.CurrentTimestampH",
+    "triggerInputs.SerdesRst",
+    "triggerInputs.ThrCount0",
+    "triggerInputs.ThrCount1",
+    "triggerInputs.ThrCount2",
+    "triggerInputs.ThrCount3",
+    "triggerInputs.ThrCount4",
+    "triggerInputs.ThrCount5",
+    "triggerLogic.PostVetoTriggers",
+    "triggerLogic.PreVetoTriggers",
+    "triggerLogic.ExternalTriggerVeto",
+    "triggerLogic.AuxTriggerCount",
+)
+
+
+class CachedWord:
+    """Register value served from the shadow cache, behaves like an already dispatched read."""
+
+    def __init__(self, value: int) -> None:
+        self._value = value
+
+    def valid(self) -> bool:
+        return True
+
+    def value(self) -> int:
+        return self._value
+
+
+class RegisterRead:
+    """Deferred result of a register read. The value is only available after the IPbus
+    transaction containing the read has been dispatched.
+    """
+
+    def __init__(self, i2c, register: str, word) -> None:
+        self.i2c = i2c
+        self.register = register
+        self._word = word
+
+    def ready(self) -> bool:
+        """True if the read has been dispatched and holds a valid value."""
+        return self._word.valid()
+
+    def value(self) -> int:
+        """Returns the register value. Dispatches the pending transaction if this has not happened yet.
+
+        Returns:
+            int: Content of the register.
+        """
+        if not self._word.valid():
+            self.i2c.dispatch()
+        if self._word.valid():
+            return self._word.value()
+        raise RuntimeError("Error reading register %s" % self.register)
+
+
+class RegisterBlockRead:
+    """Deferred result of a block read. The words are only available after the IPbus
+    transaction containing the read has been dispatched.
+    """
+
+    def __init__(self, i2c, register: str, vector) -> None:
+        self.i2c = i2c
+        self.register = register
+        self._vector = vector
+
+    def ready(self) -> bool:
+        """True if the read has been dispatched and holds valid words."""
+        return self._vector.valid()
+
+    def values(self) -> np.ndarray:
+        """Returns the words of the block read. Dispatches the pending transaction if this has not happened yet.
+
+        Returns:
+            np.ndarray: uint32 array of the read words.
+        """
+        if not self._vector.valid():
+            self.i2c.dispatch()
+        if self._vector.valid():
+            return np.fromiter(self._vector, dtype=np.uint32, count=self._vector.size())
+        raise RuntimeError("Error reading register block %s" % self.register)
+
 
 class I2CCore:
-    def __init__(self, hw_int):
-        """hw_int: IPBus HwInterface instance"""
+    def __init__(self, hw_int, pipeline: bool = False, timeout: float = 1.0):
+        """hw_int: IPBus HwInterface instance
+        pipeline: Send each I2C command together with its status polling in one IPbus dispatch (opt-in)
+        timeout: Maximum time in seconds to wait for a single I2C command
+        """
         self.log = logger.setup_derived_logger(__class__.__name__)
         self.i2c_hw = hw_int
         self.modules = {}
+        self.register_map = None
+        # uhal nodes resolved once per register name
+        self._nodes = {}
+        self._transaction_depth = 0
+        # Serializes register access and I2C transfers of different threads, e.g. readout and status
+        self._lock = threading.RLock()
+        self._shadow = None
+        self._volatile = set(volatile_registers)
+        # The I2C master has no notion of waiting, so every command in a pipelined transfer
+        # is followed by a non-incrementing block read of the status register. A command written
+        # while the master is busy is lost, so writes dispatch one command at a time and the next
+        # command is only written once the master is idle. The number of samples is derived from
+        # the clock prescale with pipeline_margin, so the master is usually idle at the last sample.
+        self.pipeline = pipeline
+        self.pipeline_margin = 1.0
+        self.pipeline_poll_words = self._command_poll_words(0x30)
+        self.pipeline_max_poll_words = 1 << 16
+        self.pipeline_fallbacks = 0
+        # Waiting for an I2C command first polls the status without delay,
+        # then backs off exponentially until the timeout is reached.
+        self.wait_timeout = timeout
+        self.wait_spin_polls = 4
+        self.wait_backoff_start = 1e-5
+        self.wait_backoff_max = 0.01
+        self.wait_statistics = Counter()
+        # Number of addresses probed in one IPbus dispatch during the bus scan
+        self.probe_batch_size = 16
 
-    def init(self):
+    def init(self, full_scan: bool = False, cache_file: str | None = None):
+        """Enables the I2C bus and searches for the connected I2C modules.
+
+        Args:
+            full_scan (bool, optional): Probe all 128 addresses instead of only the known modules. Defaults to False.
+            cache_file (str | None, optional): JSON file caching the results of the full scan per board ID.
+                With a cached result only the cached addresses are validated. Defaults to None.
+        """
         self.set_i2c_clock_prescale(0x30)
         self.set_i2c_control(0x80)
 
@@ -36,30 +182,238 @@ class I2CCore:
                 "Enabling Enclustra I2C bus might have failed. This could prevent from talking to the I2C slaves on the TLU."
             )
 
-        for addr in range(128):
-            self.set_i2c_tx((addr << 1) | 0x0)
-            self.set_i2c_command(0x90)
-            if (self.get_i2c_status() >> 7 & 0x01) == 0:
-                if addr in i2c_addr.values():
-                    self.log.debug(
-                        "Module %s found at address %s"
-                        % (
-                            list(i2c_addr.keys())[
-                                list(i2c_addr.values()).index(addr)
-                            ].upper(),
-                            hex(addr),
-                        )
-                    )
-                    self.modules[
-                        list(i2c_addr.keys())[list(i2c_addr.values()).index(addr)]
-                    ] = addr
-                else:
-                    self.log.debug(
-                        "Unknown module found at address %s, not in address list"
-                        % hex(addr)
+        self.scan(full_scan, cache_file)
+
+    def scan(self, full_scan: bool = False, cache_file: str | None = None) -> list:
+        """Searches for connected I2C modules and adds the known ones to the module table.
+        The known module addresses are probed first, the full scan of all addresses is optional.
+
+        Args:
+            full_scan (bool, optional): Probe all 128 addresses instead of only the known modules. Defaults to False.
+            cache_file (str | None, optional): JSON file caching the results of the full scan per board ID. Defaults to None.
+
+        Returns:
+            list: Addresses of all found modules.
+        """
+        found = self.probe(sorted(i2c_modules))
+        for addr in found:
+            self.modules[i2c_modules[addr]] = addr
+
+        if full_scan:
+            board_id = None
+            cache = {}
+            if cache_file is not None and "eeprom" in self.modules:
+                board_id = "%012x" % self.get_board_id()
+                cache = _load_scan_cache(cache_file)
+            cached = cache.get(board_id)
+            if (
+                cached is not None
+                and set(found) == set(cached) & set(i2c_modules)
+                and self.probe(cached) == cached
+            ):
+                self.log.debug("Validated cached I2C scan of board %s" % board_id)
+                found = cached
+            else:
+                found = self.probe(list(range(128)))
+                if board_id is not None:
+                    cache[board_id] = found
+                    _store_scan_cache(cache_file, cache)
+
+        for addr in found:
+            if addr in i2c_modules:
+                self.log.debug(
+                    "Module %s found at address %s"
+                    % (i2c_modules[addr].upper(), hex(addr))
+                )
+                self.modules[i2c_modules[addr]] = addr
+            else:
+                self.log.debug(
+                    "Unknown module found at address %s, not in address list"
+                    % hex(addr)
+                )
+        return found
+
+    def probe(self, addresses: list) -> list:
+        """Probes I2C addresses by sending the address byte and checking the acknowledge.
+        The addresses are probed in batches, each in a single IPbus dispatch if pipelining is enabled.
+
+        Args:
+            addresses (list): I2C addresses to probe.
+
+        Returns:
+            list: Addresses acknowledging the probe.
+        """
+        with self._lock:
+            found = []
+            for start in range(0, len(addresses), self.probe_batch_size):
+                batch = addresses[start : start + self.probe_batch_size]
+                acks = self._probe_pipelined(batch) if self.pipeline else None
+                if acks is None:
+                    acks = []
+                    for addr in batch:
+                        self.set_i2c_tx((addr << 1) | 0x0)
+                        self.set_i2c_command(0x90)
+                        acks.append((self.get_i2c_status() >> 7 & 0x01) == 0)
+                found += [addr for addr, ack in zip(batch, acks) if ack]
+            self.set_i2c_tx(0x0)
+            self.set_i2c_command(0x50)
+            return found
+
+    def _probe_pipelined(self, addresses: list) -> list | None:
+        """Probes I2C addresses in one IPbus dispatch.
+
+        Args:
+            addresses (list): I2C addresses to probe.
+
+        Returns:
+            list | None: Acknowledge of each address, None if a probe did not finish in time.
+        """
+        status = []
+        with self.transaction():
+            for addr in addresses:
+                self.write_register("i2c_master.i2c_rxtx", (addr << 1) | 0x0)
+                self.write_register("i2c_master.i2c_cmdstatus", 0x90)
+                status.append(
+                    self.read_register_samples_deferred(
+                        "i2c_master.i2c_cmdstatus", self.pipeline_poll_words
                     )
-        self.set_i2c_tx(0x0)
-        self.set_i2c_command(0x50)
+                )
+
+        last_status = [samples.values()[-1] for samples in status]
+        if any((word >> 1) & 0x1 for word in last_status):
+            self.pipeline_fallbacks += 1
+            self.pipeline_poll_words = min(
+                2 * self.pipeline_poll_words, self.pipeline_max_poll_words
+            )
+            self.wait_for_transfer()
+            return None
+        return [(word >> 7) & 0x1 == 0 for word in last_status]
+
+    def get_board_id(self) -> int:
+        """Read back board id from the EEPROM. Consists of six blocks of hex data
+
+        Returns:
+            int: Board id as 48 bits integer
+        """
+        id = []
+        for addr in range(6):
+            id.append(self.read(self.modules["eeprom"], 0xFA + addr) & 0xFF)
+        return int("0x" + "".join(["{:x}".format(i) for i in id]), 16) & 0xFFFFFFFFFFFF
+
+    @contextmanager
+    def transaction(self):
+        """Batches register accesses. All writes and reads inside the context are queued
+        and sent to the TLU in a single IPbus dispatch when the context is left.
+        Use read_register_deferred to queue reads, read_register inside a transaction
+        dispatches everything queued so far. Nested transactions are merged into the outermost one.
+        Other threads wait until the transaction is dispatched.
+
+        Example:
+            with i2c.transaction():
+                i2c.write_register("triggerLogic.TriggerVetoW", 1)
+                counter = i2c.read_register_deferred("triggerLogic.PostVetoTriggersR")
+            counter.value()
+        """
+        with self._lock:
+            self._transaction_depth += 1
+            try:
+                yield self
+            finally:
+                self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.dispatch()
+
+    @property
+    def in_transaction(self) -> bool:
+        """True inside a transaction, queued accesses are not dispatched yet."""
+        return self._transaction_depth > 0
+
+    def dispatch(self) -> None:
+        """Sends all queued IPbus transactions to the TLU."""
+        try:
+            self.i2c_hw.dispatch()
+        except Exception:
+            # Queued writes might not have reached the TLU
+            self.clear_shadow_cache()
+            raise
+
+    def load_register_map(
+        self,
+        fw_version: int,
+        connection_file: str = CONNECTION_FILE,
+        device_id: str = "aida_tlu.controlhub",
+    ) -> RegisterMap:
+        """Compiles the register map of the address table uhal uses for the TLU connection.
+        Warns if the firmware version asks for a different address table.
+
+        Args:
+            fw_version (int): Firmware version of the TLU.
+            connection_file (str, optional): uhal connection file. Defaults to the connection file in the misc folder.
+            device_id (str, optional): ID of the connection. Defaults to "aida_tlu.controlhub".
+
+        Returns:
+            RegisterMap: Compiled register map.
+        """
+        file_path = connection_address_table(connection_file, device_id)
+        self.register_map = RegisterMap(file_path)
+        self.log.debug("Using address table %s" % file_path.name)
+        expected = address_table(fw_version)
+        if expected.name != file_path.name:
+            self.log.warning(
+                "Firmware version %s matches address table %s, but the connection uses %s"
+                % (hex(fw_version), expected.name, file_path.name)
+            )
+        return self.register_map
+
+    def check_registers(self, registers: list) -> None:
+        """Checks register names against the register map, e.g. before a run.
+
+        Args:
+            registers (list): Names of nodes in address file
+
+        Raises:
+            KeyError: If a register name is not in the address table.
+        """
+        if self.register_map is None:
+            raise RuntimeError("No register map loaded")
+        self.register_map.check(registers)
+
+    def enable_shadow_cache(self, volatile: list | tuple | None = None) -> None:
+        """Enables the write-through shadow cache. The last value written to a register is remembered
+        and reads of the corresponding read register are served from memory instead of the TLU.
+        Read and write registers are paired by their name without the trailing R or W,
+        e.g. 'triggerLogic.TriggerVetoW' and 'triggerLogic.TriggerVetoR'.
+        Note that registers the firmware modifies on write, e.g. the rounded internal trigger interval,
+        are returned as written.
+
+        Args:
+            volatile (list | tuple | None, optional): Registers (without trailing R/W) or node groups that are always read from the TLU.
+                                                      Defaults to the counters, FIFO, timestamp and I2C master registers.
+        """
+        self._shadow = {}
+        if volatile is not None:
+            self._volatile = set(volatile)
+
+    def disable_shadow_cache(self) -> None:
+        """Disables the shadow cache, all reads access the TLU."""
+        self._shadow = None
+
+    def clear_shadow_cache(self) -> None:
+        """Forgets all cached register values."""
+        if self._shadow is not None:
+            self._shadow.clear()
+
+    def _shadow_key(self, register: str) -> str | None:
+        """Name of the register in the shadow cache. None for volatile registers."""
+        if register.endswith("RW"):
+            key = register
+        elif register[-1] in "RW":
+            key = register[:-1]
+        else:
+            key = register
+        if key in self._volatile or key.split(".")[0] in self._volatile:
+            return None
+        return key
 
     def write_register(self, register: str, value: int) -> None:
         """
@@ -68,24 +422,99 @@ class I2CCore:
         """
         if not isinstance(value, int):
             raise TypeError("Value must be integer")
-        try:
-            self.i2c_hw.getNode(register).write(value)
-            self.i2c_hw.dispatch()
-        except Exception as e:
-            raise e
+        with self.transaction():
+            self._queue_write(register, value)
+            if self._shadow is not None:
+                key = self._shadow_key(register)
+                if key is not None:
+                    self._shadow[key] = value
 
     def read_register(self, register: str) -> int:
         """
         register: str  Name of node in address file
         """
+        return self.read_register_deferred(register).value()
+
+    def read_register_deferred(self, register: str) -> RegisterRead:
+        """Queues a register read. Outside of a transaction the read is dispatched immediately.
+
+        Args:
+            register (str): Name of node in address file
+
+        Returns:
+            RegisterRead: Deferred read, the value is available after dispatch.
+        """
+        if self._shadow is not None:
+            key = self._shadow_key(register)
+            if key in self._shadow:
+                return RegisterRead(self, register, CachedWord(self._shadow[key]))
+        with self.transaction():
+            read = RegisterRead(self, register, self._queue_read(register))
+        return read
+
+    def read_register_samples_deferred(
+        self, register: str, n_samples: int
+    ) -> RegisterBlockRead:
+        """Queues n_samples consecutive reads of the same register as a single non-incrementing block read.
+        Outside of a transaction the read is dispatched immediately.
+
+        Args:
+            register (str): Name of node in address file
+            n_samples (int): Number of reads
+
+        Returns:
+            RegisterBlockRead: Deferred read, the samples are available after dispatch.
+        """
+        with self.transaction():
+            read = RegisterBlockRead(
+                self, register, self._queue_read_samples(register, n_samples)
+            )
+        return read
+
+    def read_register_block_deferred(
+        self, register: str, n_words: int
+    ) -> RegisterBlockRead:
+        """Queues a block read of n_words words, e.g. from a FIFO node.
+        Outside of a transaction the read is dispatched immediately.
+
+        Args:
+            register (str): Name of node in address file
+            n_words (int): Number of words
+
+        Returns:
+            RegisterBlockRead: Deferred read, the words are available after dispatch.
+        """
+        with self.transaction():
+            read = RegisterBlockRead(
+                self, register, self._queue_read_block(register, n_words)
+            )
+        return read
+
+    def _node(self, register: str):
+        """uhal node of a register, resolved on first access."""
         try:
-            ret = self.i2c_hw.getNode(register).read()
-            self.i2c_hw.dispatch()
-            if ret.valid():
-                return ret.value()
-            raise RuntimeError("Error reading register %s" % register)
-        except Exception as e:
-            raise e
+            return self._nodes[register]
+        except KeyError:
+            node = self._nodes[register] = self.i2c_hw.getNode(register)
+            return node
+
+    def _queue_write(self, register: str, value: int) -> None:
+        self._node(register).write(value)
+
+    def _queue_read(self, register: str):
+        return self._node(register).read()
+
+    def _queue_read_block(self, register: str, n_words: int):
+        return self._node(register).readBlock(n_words)
+
+    def _queue_read_samples(self, register: str, n_samples: int):
+        import uhal
+
+        return self.i2c_hw.getClient().readBlock(
+            self._node(register).getAddress(),
+            n_samples,
+            uhal.BlockReadWriteMode.NON_INCREMENTAL,
+        )
 
     def get_i2c_status(self):
         return self.read_register("i2c_master.i2c_cmdstatus")
@@ -95,8 +524,7 @@ class I2CCore:
 
     def set_i2c_command(self, value: int):
         self.write_register("i2c_master.i2c_cmdstatus", value & 0xFF)
-        while self.is_done():
-            time.sleep(1)
+        self.wait_for_transfer()
 
     def set_i2c_tx(self, value: int):
         self.write_register("i2c_master.i2c_rxtx", value & 0xFF)
@@ -104,65 +532,218 @@ class I2CCore:
     def is_done(self) -> bool:
         return bool((self.get_i2c_status() >> 1) & 0x1)
 
+    def wait_for_transfer(self) -> None:
+        """Waits until the I2C master finished the current command. The status is polled
+        without delay for wait_spin_polls times, afterwards the delay between polls starts at
+        wait_backoff_start and is doubled up to wait_backoff_max. How often each stage was
+        needed is counted in wait_statistics.
+
+        Raises:
+            TimeoutError: Command did not finish within wait_timeout seconds.
+        """
+        if not self.is_done():
+            self.wait_statistics["immediate"] += 1
+            return
+        for _ in range(self.wait_spin_polls):
+            if not self.is_done():
+                self.wait_statistics["spin"] += 1
+                return
+        delay = self.wait_backoff_start
+        deadline = time.perf_counter() + self.wait_timeout
+        while self.is_done():
+            if time.perf_counter() > deadline:
+                self.wait_statistics["timeout"] += 1
+                raise TimeoutError(
+                    "I2C command did not finish within %s s" % self.wait_timeout
+                )
+            time.sleep(delay)
+            delay = min(2 * delay, self.wait_backoff_max)
+        self.wait_statistics["backoff"] += 1
+
     def set_i2c_clock_prescale(self, value: int):
         self.write_register("i2c_master.i2c_pre_lo", value & 0xFF)
         self.write_register("i2c_master.i2c_pre_hi", (value >> 8) & 0xFF)
+        self.pipeline_poll_words = self._command_poll_words(value & 0xFFFF)
 
-    def write(self, device_addr: int, mem_addr: int, value: int) -> None:
-        self.set_i2c_tx((device_addr << 1) | 0x0)
-        self.set_i2c_command(0x90)
+    def _command_poll_words(self, prescale: int) -> int:
+        """Number of status samples covering a single I2C command at the given clock prescale.
+        A command transfers a byte and the acknowledge plus a start or stop condition,
+        one SCL period takes 5 * (prescale + 1) cycles of the I2C master clock.
 
-        self.set_i2c_tx(mem_addr)
-        self.set_i2c_command(0x10)
+        Args:
+            prescale (int): Clock prescale of the I2C master.
+
+        Returns:
+            int: Number of status samples including pipeline_margin.
+        """
+        command_time = 10 * 5 * (prescale + 1) / i2c_core_clock
+        return ceil(self.pipeline_margin * command_time / ipbus_word_time)
 
+    def write(self, device_addr: int, mem_addr: int, value: int) -> None:
+        value = int(value)
         if value > 0xFF:
-            n_bytes_to_write = ceil(len(hex(value)[2:] / 2))
-            for byte in range(
-                8 * (n_bytes_to_write - 1), 0, -8
-            ):  # funky magic to write byte by byte
-                to_write = (value & (0xFF << byte)) >> byte
-                self.set_i2c_tx(to_write)
-                self.set_i2c_command(0x10)
-        self.set_i2c_tx(value & 0xFF)
-        self.set_i2c_command(0x50)
-        self._compare_value_read_write(
-            value, self.read(device_addr, mem_addr), device_addr
+            n_bytes_to_write = ceil(len(hex(value)[2:]) / 2)
+        else:
+            n_bytes_to_write = 1
+        # Most significant byte first
+        data = [
+            (value >> byte) & 0xFF for byte in range(8 * (n_bytes_to_write - 1), -8, -8)
+        ]
+        # The written value is verified by reading it back within the same transfer.
+        read_back = self._execute_i2c_transfer(
+            self._write_sequence(device_addr, mem_addr, data)
+            + self._read_sequence(device_addr, mem_addr),
+            read_result=True,
         )
+        self._compare_value_read_write(value, read_back, device_addr)
 
     def read(self, device_addr: int, mem_addr: int) -> int:
-        self.set_i2c_tx((device_addr << 1) | 0x0)
-        self.set_i2c_command(0x90)
+        return self._execute_i2c_transfer(
+            self._read_sequence(device_addr, mem_addr), read_result=True
+        )
 
-        self.set_i2c_tx(mem_addr)
-        self.set_i2c_command(0x10)
+    def write_array(self, device_addr: int, mem_addr: int, values: list) -> None:
+        self._execute_i2c_transfer(
+            self._write_sequence(device_addr, mem_addr, list(values))
+        )
 
-        self.set_i2c_tx((device_addr << 1) | 0x1)
-        self.set_i2c_command(0x90)
-        self.set_i2c_command(0x28)
+    def _write_sequence(self, device_addr: int, mem_addr: int, data: list) -> list:
+        """Compiles an I2C write into a list of (transmit byte, command) steps.
+        Start with the device address, the memory address, the data bytes and a stop after the last byte.
 
-        return self.read_register("i2c_master.i2c_rxtx")
+        Args:
+            device_addr (int): I2C address of the device.
+            mem_addr (int): Memory address on the device.
+            data (list): Data bytes to be written.
 
-    def write_array(self, device_addr: int, mem_addr: int, values: list) -> None:
-        self.set_i2c_tx((device_addr << 1) | 0x0)
-        self.set_i2c_command(0x90)
-
-        self.set_i2c_tx(mem_addr)
-        self.set_i2c_command(0x10)
-
-        for i in range(len(values) - 1):
-            if i > 0xFF:
-                n_bytes_to_write = ceil(len(hex(i)[2:] / 2))
-                for byte in range(
-                    8 * (n_bytes_to_write - 1), 0, -8
-                ):  # funky magic to write byte by byte
-                    to_write = (i & (0xFF << byte)) >> byte
-                    self.set_i2c_tx(to_write)
-                    self.set_i2c_command(0x10)
-            self.set_i2c_tx(values[i] & 0xFF)
-            self.set_i2c_command(0x10)
-
-        self.set_i2c_tx(values[-1] & 0xFF)
-        self.set_i2c_command(0x50)
+        Returns:
+            list: (transmit byte, command) steps of the transfer.
+        """
+        sequence = [((device_addr << 1) | 0x0, 0x90), (mem_addr, 0x10)]
+        sequence += [(byte, 0x10) for byte in data[:-1]]
+        sequence.append((data[-1], 0x50))
+        return sequence
+
+    def _read_sequence(self, device_addr: int, mem_addr: int) -> list:
+        """Compiles an I2C single byte read into a list of (transmit byte, command) steps.
+        The read byte is found in the rxtx register after the transfer.
+
+        Args:
+            device_addr (int): I2C address of the device.
+            mem_addr (int): Memory address on the device.
+
+        Returns:
+            list: (transmit byte, command) steps of the transfer, None marks steps without transmit byte.
+        """
+        return [
+            ((device_addr << 1) | 0x0, 0x90),
+            (mem_addr, 0x10),
+            ((device_addr << 1) | 0x1, 0x90),
+            (None, 0x28),
+        ]
+
+    def _execute_i2c_transfer(self, sequence: list, read_result: bool = False):
+        """Executes a compiled I2C transfer. Without pipelining each command is issued and polled separately.
+        With pipelining, transfers writing data send each command together with its status samples in one
+        IPbus dispatch and the next command is only written once the master is idle. Transfers without
+        data writes, i.e. reads, are sent in a single dispatch and repeated step by step if they did not finish in time.
+
+        Args:
+            sequence (list): (transmit byte, command) steps of the transfer.
+            read_result (bool, optional): Return the content of the rxtx register after the transfer. Defaults to False.
+
+        Returns:
+            int | None: Received byte if read_result is set.
+        """
+        with self._lock:
+            if self.pipeline:
+                if any(command == 0x50 for _, command in sequence):
+                    return self._execute_checked(sequence, read_result)
+                success, result = self._execute_pipelined(sequence, read_result)
+                if success:
+                    return result
+                self.pipeline_fallbacks += 1
+                self.pipeline_poll_words = min(
+                    2 * self.pipeline_poll_words, self.pipeline_max_poll_words
+                )
+                self.log.debug(
+                    "Pipelined I2C transfer incomplete, retrying step by step. Using %i status samples per command."
+                    % self.pipeline_poll_words
+                )
+                # Wait for the last command and release the bus before retrying.
+                self.wait_for_transfer()
+                self.set_i2c_command(0x40)
+
+            for tx, command in sequence:
+                if tx is not None:
+                    self.set_i2c_tx(tx)
+                self.set_i2c_command(command)
+            if read_result:
+                return self.read_register("i2c_master.i2c_rxtx")
+
+    def _execute_checked(self, sequence: list, read_result: bool):
+        """Sends a compiled I2C transfer one command per IPbus dispatch, each command followed by its status samples.
+        If the master is still busy at the last sample the status is polled before the next command is written,
+        so no command is lost and no byte is written to another register.
+
+        Args:
+            sequence (list): (transmit byte, command) steps of the transfer.
+            read_result (bool): Read the rxtx register after the transfer.
+
+        Returns:
+            int | None: Received byte if read_result is set.
+        """
+        for step, (tx, command) in enumerate(sequence):
+            result = None
+            with self.transaction():
+                if tx is not None:
+                    self.write_register("i2c_master.i2c_rxtx", tx & 0xFF)
+                self.write_register("i2c_master.i2c_cmdstatus", command & 0xFF)
+                samples = self.read_register_samples_deferred(
+                    "i2c_master.i2c_cmdstatus", self.pipeline_poll_words
+                )
+                if read_result and step == len(sequence) - 1:
+                    result = self.read_register_deferred("i2c_master.i2c_rxtx")
+            if (samples.values()[-1] >> 1) & 0x1:
+                self.pipeline_fallbacks += 1
+                self.wait_for_transfer()
+                result = None
+        if read_result:
+            if result is None:
+                return self.read_register("i2c_master.i2c_rxtx")
+            return result.value()
+
+    def _execute_pipelined(self, sequence: list, read_result: bool) -> tuple:
+        """Sends a compiled I2C transfer in one IPbus dispatch, only used for transfers without data writes.
+        Each command is followed by status samples, the transfer only succeeded if
+        the I2C master was idle at the last sample before the next command was written.
+
+        Args:
+            sequence (list): (transmit byte, command) steps of the transfer.
+            read_result (bool): Read the rxtx register after the transfer.
+
+        Returns:
+            tuple: Success of the transfer and the received byte.
+        """
+        status = []
+        result = None
+        with self.transaction():
+            for tx, command in sequence:
+                if tx is not None:
+                    self.write_register("i2c_master.i2c_rxtx", tx & 0xFF)
+                self.write_register("i2c_master.i2c_cmdstatus", command & 0xFF)
+                status.append(
+                    self.read_register_samples_deferred(
+                        "i2c_master.i2c_cmdstatus", self.pipeline_poll_words
+                    )
+                )
+            if read_result:
+                result = self.read_register_deferred("i2c_master.i2c_rxtx")
+
+        for samples in status:
+            if (samples.values()[-1] >> 1) & 0x1:
+                return False, None
+        return True, (result.value() if read_result else None)
 
     def _compare_value_read_write(self, written: int, read: int, function: str) -> None:
         if written != read:
@@ -172,3 +753,30 @@ class I2CCore:
             )
         else:
             pass
+
+
+def _load_scan_cache(cache_file: str) -> dict:
+    """Loads the cached I2C scan results, board IDs are the keys.
+
+    Args:
+        cache_file (str): Path to the JSON cache file.
+
+    Returns:
+        dict: Found addresses per board ID, empty if there is no valid cache.
+    """
+    try:
+        with open(cache_file, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _store_scan_cache(cache_file: str, cache: dict) -> None:
+    """Stores the I2C scan results.
+
+    Args:
+        cache_file (str): Path to the JSON cache file.
+        cache (dict): Found addresses per board ID.
+    """
+    with open(cache_file, "w") as file:
+        json.dump(cache, file, indent=4)
@@ -4,6 +4,9 @@ from aidatlu import logger
 from aidatlu.hardware.i2c import I2CCore
 from aidatlu.hardware.utils import _set_bit
 
+# Output ports (io_exp, exp_id, cmd_byte) of the two LED expanders, least significant byte first
+led_ports = [(1, 1, 2), (1, 1, 3), (1, 2, 2), (1, 2, 3)]
+
 
 class IOControl:
     """Main class for the control of the IO expander PCA9539PW.
@@ -16,6 +19,8 @@ class IOControl:
 
         self.log.info("Initializing IO expander")
         self.i2c = i2c
+        # Local mirror of the output ports, keys are (io_exp, exp_id, cmd_byte)
+        self._outputs = {}
 
         self.init_led_expander()
         self.init_output_expander()
@@ -67,36 +72,17 @@ class IOControl:
         if color not in ["w", "r", "g", "b"]:
             raise ValueError("%s color not supported" % color)
 
-        if color == "w":
-            self._set_ioexpander_output(io_exp=1, exp_id=1, cmd_byte=2, value=0x0)
-            self._set_ioexpander_output(io_exp=1, exp_id=1, cmd_byte=3, value=0x0)
-            self._set_ioexpander_output(io_exp=1, exp_id=2, cmd_byte=2, value=0x0)
-            self._set_ioexpander_output(io_exp=1, exp_id=2, cmd_byte=3, value=0x0)
-
-        if color == "r":
-            self._set_ioexpander_output(io_exp=1, exp_id=1, cmd_byte=2, value=0xB5)
-            self._set_ioexpander_output(io_exp=1, exp_id=1, cmd_byte=3, value=0x6D)
-            self._set_ioexpander_output(io_exp=1, exp_id=2, cmd_byte=2, value=0xDB)
-            self._set_ioexpander_output(io_exp=1, exp_id=2, cmd_byte=3, value=0xB6)
-
-        if color == "g":
-            self._set_ioexpander_output(io_exp=1, exp_id=1, cmd_byte=2, value=0xDA)
-            self._set_ioexpander_output(io_exp=1, exp_id=1, cmd_byte=3, value=0xB6)
-            self._set_ioexpander_output(io_exp=1, exp_id=2, cmd_byte=2, value=0x6D)
-            self._set_ioexpander_output(io_exp=1, exp_id=2, cmd_byte=3, value=0xDB)
-
-        if color == "b":
-            self._set_ioexpander_output(io_exp=1, exp_id=1, cmd_byte=2, value=0x6F)
-            self._set_ioexpander_output(io_exp=1, exp_id=1, cmd_byte=3, value=0xDB)
-            self._set_ioexpander_output(io_exp=1, exp_id=2, cmd_byte=2, value=0xB6)
-            self._set_ioexpander_output(io_exp=1, exp_id=2, cmd_byte=3, value=0x6D)
+        patterns = {
+            "w": [0x0, 0x0, 0x0, 0x0],
+            "r": [0xB5, 0x6D, 0xDB, 0xB6],
+            "g": [0xDA, 0xB6, 0x6D, 0xDB],
+            "b": [0x6F, 0xDB, 0xB6, 0x6D],
+        }
+        self._set_led_outputs(patterns[color])
 
     def all_off(self) -> None:
         """Turn off all LEDs"""
-        self._set_ioexpander_output(io_exp=1, exp_id=1, cmd_byte=2, value=0xFF)
-        self._set_ioexpander_output(io_exp=1, exp_id=1, cmd_byte=3, value=0xFF)
-        self._set_ioexpander_output(io_exp=1, exp_id=2, cmd_byte=2, value=0xFF)
-        self._set_ioexpander_output(io_exp=1, exp_id=2, cmd_byte=3, value=0xFF)
+        self._set_led_outputs([0xFF, 0xFF, 0xFF, 0xFF])
 
     def switch_led(self, led_id: int, color: str = "off") -> None:
         """changes LED with led_id to specific color
@@ -162,18 +148,10 @@ class IOControl:
             [1, 0, 19],
         ]
 
-        status_now = []  # status of all ioexpander now
-        status_next = []  # status of all ioexpander next
-        status_now.append(0xFF & self._get_ioexpander_output(1, 1, 2))
-        status_now.append(0xFF & self._get_ioexpander_output(1, 1, 3))
-        status_now.append(0xFF & self._get_ioexpander_output(1, 2, 2))
-        status_now.append(0xFF & self._get_ioexpander_output(1, 2, 3))
-
+        # The four LED expander output bytes form one 32-bit word
         word = 0x00000000
-        word = word | status_now[0]
-        word = word | (status_now[1] << 8)
-        word = word | (status_now[2] << 16)
-        word = word | (status_now[3] << 24)
+        for index, port in enumerate(led_ports):
+            word = word | (self._get_output_state(*port) << (8 * index))
 
         for index in range(3):
             if (
@@ -184,22 +162,15 @@ class IOControl:
             else:
                 word = _set_bit(word, indicator[led_id - 1][index], rgb[index])
 
-        status_next.append(0xFF & word)
-        status_next.append(0xFF & (word >> 8))
-        status_next.append(0xFF & (word >> 16))
-        status_next.append(0xFF & (word >> 24))
-
-        if status_now[0] != status_next[0]:
-            self._set_ioexpander_output(1, 1, 2, status_next[0])
+        self._set_led_outputs([0xFF & (word >> (8 * index)) for index in range(4)])
 
-        if status_now[1] != status_next[1]:
-            self._set_ioexpander_output(1, 1, 3, status_next[1])
+    def _set_led_outputs(self, values: list) -> None:
+        """Sets the four LED expander output bytes, only changed bytes are written.
 
-        if status_now[2] != status_next[2]:
-            self._set_ioexpander_output(1, 2, 2, status_next[2])
-
-        if status_now[3] != status_next[3]:
-            self._set_ioexpander_output(1, 2, 3, status_next[3])
+        Args:
+            values (list): Output bytes of LED expander 1 bank 0 and 1 and LED expander 2 bank 0 and 1.
+        """
+        self.update_outputs(dict(zip(led_ports, values)))
 
     ### Output Control ###
 
@@ -236,12 +207,12 @@ class IOControl:
         )  # DUT0 and DUT2 are on nibble 0. DUT1 and DUT3 are on nibble 1.
 
         # TODO what is happening here
-        old_status = self._get_ioexpander_output(2, expander_id, bank)
+        old_status = self._get_output_state(2, expander_id, bank)
         new_nibble = (enable & 0xF) << 4 * nibble
         mask = 0xF << 4 * nibble
         new_status = (old_status & (~mask)) | (new_nibble & mask)
 
-        self._set_ioexpander_output(2, expander_id, bank, new_status)
+        self.update_outputs({(2, expander_id, bank): new_status})
         self.log.debug("HDMI Channel %i set to %s" % (hdmi_channel + 1, str(enable)))
 
     def clock_hdmi_output(self, hdmi_channel: int, clock_source: str) -> None:
@@ -265,7 +236,7 @@ class IOControl:
         mask_low = 1 << (hdmi_channel)
         mask_high = 1 << (hdmi_channel + 4)
         mask = mask_low | mask_high
-        old_status = self._get_ioexpander_output(2, expander_id, cmd_byte)
+        old_status = self._get_output_state(2, expander_id, cmd_byte)
 
         if clock_source == "off":
             new_status = old_status & ~mask
@@ -275,7 +246,7 @@ class IOControl:
             new_status = (old_status | mask_low) & ~mask_high
         else:
             new_status = old_status
-        self._set_ioexpander_output(2, expander_id, cmd_byte, new_status)
+        self.update_outputs({(2, expander_id, cmd_byte): new_status})
         self.log.info(
             "Clock source of HDMI Channel %i set to %s."
             % (hdmi_channel + 1, clock_source)
@@ -292,12 +263,12 @@ class IOControl:
         mask = 0x10
         expander_id = 2
 
-        old_status = self._get_ioexpander_output(2, expander_id, cmd_byte) & 0xFF
+        old_status = self._get_output_state(2, expander_id, cmd_byte)
         new_status = old_status & (~mask) & 0xFF
         if enable:
             new_status = new_status | mask & 0xFF
 
-        self._set_ioexpander_output(2, expander_id, cmd_byte, new_status)
+        self.update_outputs({(2, expander_id, cmd_byte): new_status})
         if enable:
             self.switch_led(5, "g")
         else:
@@ -306,6 +277,42 @@ class IOControl:
 
     ### General Expander Control ###
 
+    def update_outputs(self, outputs: dict) -> None:
+        """Applies several output changes at once. Only bytes that differ from the local mirror are written.
+
+        Args:
+            outputs (dict): New output bytes with (io_exp, exp_id, cmd_byte) as keys.
+        """
+        for (io_exp, exp_id, cmd_byte), value in outputs.items():
+            if self._outputs.get((io_exp, exp_id, cmd_byte)) != value & 0xFF:
+                self._set_ioexpander_output(io_exp, exp_id, cmd_byte, value)
+
+    def sync_outputs(self) -> None:
+        """Reads all output ports from the expanders and updates the local mirror."""
+        for io_exp in [1, 2]:
+            for exp_id in [1, 2]:
+                for cmd_byte in [2, 3]:
+                    self._outputs[(io_exp, exp_id, cmd_byte)] = 0xFF & (
+                        self._get_ioexpander_output(io_exp, exp_id, cmd_byte)
+                    )
+
+    def _get_output_state(self, io_exp: int, exp_id: int, cmd_byte: int) -> int:
+        """Output byte from the local mirror. Ports not yet written are read from the expander.
+
+        Args:
+            io_exp (int): Expander (1 or 2). The LED expander on 1 the output expander on 2.
+            exp_id (int): ID of Expander (1 or 2).
+            cmd_byte (int): The Command byte is used as a pointer to a specific register see datasheet PC9539.
+
+        Returns:
+            int: Output byte of the port
+        """
+        if (io_exp, exp_id, cmd_byte) not in self._outputs:
+            self._outputs[(io_exp, exp_id, cmd_byte)] = 0xFF & (
+                self._get_ioexpander_output(io_exp, exp_id, cmd_byte)
+            )
+        return self._outputs[(io_exp, exp_id, cmd_byte)]
+
     def _set_ioexpander_polarity(
         self, io_exp: int, exp_id: int, cmd_byte: int, polarity: bool = False
     ) -> None:
@@ -394,6 +401,7 @@ class IOControl:
         self.i2c.write(
             self.i2c.modules["%s_%.1s" % (exp, exp_id)], cmd_byte, value & 0xFF
         )
+        self._outputs[(io_exp, exp_id, cmd_byte)] = value & 0xFF
 
     def _get_ioexpander_output(self, io_exp: int, exp_id: int, cmd_byte: int) -> int:
         """Get content of register 2 or 3
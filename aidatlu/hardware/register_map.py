@@ -0,0 +1,163 @@
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import NamedTuple
+
+MISC_PATH = Path(__file__).parent.parent / "misc"
+CONNECTION_FILE = MISC_PATH / "aida_tlu_connection.xml"
+
+
+class Register(NamedTuple):
+    """Single register of the firmware address table."""
+
+    name: str
+    address: int
+    mask: int
+    permission: str
+    mode: str
+    size: int
+
+
+class RegisterMap:
+    """Register names and addresses of a firmware version, compiled once from the IPbus address table."""
+
+    def __init__(self, file_path: str | Path) -> None:
+        self.file_path = Path(file_path)
+        self.registers = {}
+        root = ET.parse(self.file_path).getroot()
+        for node in root.findall("node"):
+            self._compile(node, "", 0)
+
+    def _compile(self, node: ET.Element, prefix: str, base_address: int) -> None:
+        """Adds a node and all its children to the register map.
+
+        Args:
+            node (ET.Element): Node of the address table.
+            prefix (str): Name of the parent node.
+            base_address (int): Address of the parent node.
+        """
+        name = prefix + node.get("id")
+        address = base_address + int(node.get("address", "0x0"), 16)
+        children = node.findall("node")
+        if not children:
+            self.registers[name] = Register(
+                name=name,
+                address=address,
+                mask=int(node.get("mask", "0xffffffff"), 16),
+                permission=node.get("permission", "rw"),
+                mode=node.get("mode", "single"),
+                size=int(node.get("size", "1")),
+            )
+        for child in children:
+            self._compile(child, name + ".", address)
+
+    def __contains__(self, register: str) -> bool:
+        return register in self.registers
+
+    def __getitem__(self, register: str) -> Register:
+        return self.registers[register]
+
+    def address(self, register: str) -> int:
+        """Absolute address of a register.
+
+        Args:
+            register (str): Name of node in address file
+
+        Returns:
+            int: Address of the register.
+        """
+        return self.registers[register].address
+
+    def check(self, registers: list) -> None:
+        """Checks that all register names exist in the address table.
+
+        Args:
+            registers (list): Names of nodes in address file
+
+        Raises:
+            KeyError: If a register name is not in the address table.
+        """
+        unknown = [register for register in registers if register not in self]
+        if unknown:
+            raise KeyError(
+                "Registers %s not in address table %s"
+                % (", ".join(unknown), self.file_path.name)
+            )
+
+
+def address_tables(path: str | Path = MISC_PATH) -> dict:
+    """Finds the address tables of all firmware versions.
+
+    Args:
+        path (str | Path, optional): Folder of the address tables. Defaults to the misc folder.
+
+    Returns:
+        dict: Paths of the address tables with the firmware versions as keys.
+    """
+    tables = {}
+    for file_path in Path(path).glob("aida_tlu_address-fw_version_*.xml"):
+        match = re.fullmatch(
+            r"aida_tlu_address-fw_version_([0-9a-fA-F]+)", file_path.stem
+        )
+        if match:
+            tables[int(match.group(1), 16)] = file_path
+    return tables
+
+
+def address_table(fw_version: int, path: str | Path = MISC_PATH) -> Path:
+    """Finds the newest address table not newer than the firmware.
+    If there is none, the latest address table is used.
+
+    Args:
+        fw_version (int): Firmware version of the TLU.
+        path (str | Path, optional): Folder of the address tables. Defaults to the misc folder.
+
+    Returns:
+        Path: Path of the address table.
+    """
+    tables = address_tables(path)
+    if not tables:
+        raise FileNotFoundError("No address table found in %s" % path)
+    versions = [version for version in tables if version <= fw_version]
+    version = max(versions) if versions else max(tables)
+    return tables[version]
+
+
+def connection_address_table(
+    connection_file: str | Path = CONNECTION_FILE,
+    device_id: str = "aida_tlu.controlhub",
+) -> Path:
+    """Finds the address table uhal uses for a device of the connection file.
+
+    Args:
+        connection_file (str | Path, optional): uhal connection file. Defaults to the connection file in the misc folder.
+        device_id (str, optional): ID of the connection. Defaults to "aida_tlu.controlhub".
+
+    Returns:
+        Path: Path of the address table.
+
+    Raises:
+        KeyError: If the connection file has no connection with the device ID.
+    """
+    connection_file = Path(connection_file)
+    root = ET.parse(connection_file).getroot()
+    for connection in root.iter("connection"):
+        if connection.get("id") == device_id:
+            table = connection.get("address_table").removeprefix("file://")
+            # Relative paths are resolved relative to the connection file, as uhal does
+            return connection_file.parent / table
+    raise KeyError("No connection %s in %s" % (device_id, connection_file.name))
+
+
+def load_register_map(fw_version: int, path: str | Path = MISC_PATH) -> RegisterMap:
+    """Compiles the register map of the newest address table not newer than the firmware.
+    If there is none, the latest address table is used.
+
+    Args:
+        fw_version (int): Firmware version of the TLU.
+        path (str | Path, optional): Folder of the address tables. Defaults to the misc folder.
+
+    Returns:
+        RegisterMap: Compiled register map.
+    """
+    return RegisterMap(address_table(fw_version, path))
@@ -1,4 +1,5 @@
 from curses import echo
+from typing import NamedTuple
 
 import numpy as np
 
@@ -6,20 +7,86 @@ from aidatlu import logger
 from aidatlu.hardware.clock_controller import ClockControl
 from aidatlu.hardware.dac_controller import DacControl
 from aidatlu.hardware.dut_controller import DUTLogic
-from aidatlu.hardware.i2c import I2CCore
+from aidatlu.hardware.i2c import I2CCore, RegisterRead
 from aidatlu.hardware.ioexpander_controller import IOControl
 from aidatlu.hardware.trigger_controller import TriggerLogic
 
+# Registers accessed by the TLU control, checked against the address table before configuring and starting a run
+tlu_registers = (
+    "version",
+    "i2c_master.i2c_cmdstatus",
+    "i2c_master.i2c_ctrl",
+    "i2c_master.i2c_pre_hi",
+    "i2c_master.i2c_pre_lo",
+    "i2c_master.i2c_rxtx",
+    "DUTInterfaces.DUTInterfaceModeModifierR",
+    "DUTInterfaces.DUTInterfaceModeModifierW",
+    "DUTInterfaces.DUTInterfaceModeR",
+    "DUTInterfaces.DUTInterfaceModeW",
+    "DUTInterfaces.DUTMaskR",
+    "DUTInterfaces.DUTMaskW",
+    "DUTInterfaces.IgnoreDUTBusyR",
+    "DUTInterfaces.IgnoreDUTBusyW",
+    "DUTInterfaces.IgnoreShutterVetoR",
+    "DUTInterfaces.IgnoreShutterVetoW",
+    "Event_Formatter.CurrentTimestampHR",
+    "Event_Formatter.CurrentTimestampLR",
+    "Event_Formatter.Enable_Record_Data",
+    "Event_Formatter.ResetTimestampW",
+    "Shutter.RunActiveRW",
+    "eventBuffer.EventFifoCSR",
+    "eventBuffer.EventFifoData",
+    "eventBuffer.EventFifoFillLevel",
+    "triggerInputs.InvertEdgeW",
+    "triggerInputs.SerdesRstW",
+    "triggerLogic.InternalTriggerIntervalR",
+    "triggerLogic.InternalTriggerIntervalW",
+    "triggerLogic.PostVetoTriggersR",
+    "triggerLogic.PreVetoTriggersR",
+    "triggerLogic.PulseDelayR",
+    "triggerLogic.PulseDelayW",
+    "triggerLogic.PulseStretchR",
+    "triggerLogic.PulseStretchW",
+    "triggerLogic.TriggerPattern_highR",
+    "triggerLogic.TriggerPattern_highW",
+    "triggerLogic.TriggerPattern_lowR",
+    "triggerLogic.TriggerPattern_lowW",
+    "triggerLogic.TriggerVetoR",
+    "triggerLogic.TriggerVetoW",
+) + tuple(f"triggerInputs.ThrCount{n:d}R" for n in range(6))
+
+
+class TLUStatus(NamedTuple):
+    """Consistent sample of the TLU counters, read in a single IPbus dispatch."""
+
+    timestamp: int
+    pre_veto_triggers: int
+    post_veto_triggers: int
+    scalers: tuple
+    fifo_fill_level: int
+    fifo_csr: int
+
 
 class TLUControl:
     """Controls general TLU functionalities."""
 
-    def __init__(self, hw, i2c=I2CCore) -> None:
+    def __init__(
+        self,
+        hw,
+        i2c=I2CCore,
+        shadow_cache: bool = False,
+        full_scan: bool = False,
+        scan_cache: str | None = None,
+    ) -> None:
         self.log = logger.setup_derived_logger(__class__.__name__)
         self.i2c = i2c(hw)
         self.i2c_hw = hw
         self.log.info("Initializing IPbus interface")
-        self.i2c.init()
+        self.i2c.init(full_scan=full_scan, cache_file=scan_cache)
+        self.i2c.load_register_map(self.get_fw_version())
+        if shadow_cache:
+            # Serve read back of configuration registers from memory
+            self.i2c.enable_shadow_cache()
 
         if self.i2c.modules["eeprom"]:
             self.log.info("Found device with ID %s" % hex(self.get_device_id()))
@@ -30,6 +97,8 @@ class TLUControl:
         self.clock_controller = ClockControl(self.i2c, self.io_controller)
         self.trigger_logic = TriggerLogic(self.i2c)
         self.dut_logic = DUTLogic(self.i2c)
+        # FIFO words reported by the last fill level read and not read yet
+        self._fifo_pending = 0
 
     ### General TLU Functions ###
 
@@ -44,30 +113,49 @@ class TLUControl:
         for i in range(6):
             self.dac_controller.set_threshold(i + 1, 0)
         # Resets all internal counters and raise the trigger veto.
-        self.set_run_active(False)
-        self.reset_status()
-        self.reset_counters()
-        self.trigger_logic.set_trigger_veto(True)
-        self.reset_fifo()
-        self.reset_timestamp()
+        with self.i2c.transaction():
+            run_active = self.set_run_active(False)
+            self.reset_status()
+            self.reset_counters()
+            veto_state = self.trigger_logic.set_trigger_veto(True)
+            self.reset_fifo()
+            self.reset_timestamp()
+        # Read backs are logged after the single dispatch of the transaction
+        self.log_run_active(run_active)
+        self.trigger_logic.log_trigger_veto(veto_state)
 
     def start_run(self) -> None:
         """Start run configurations"""
-        self.reset_counters()
-        self.reset_fifo()
-        self.reset_timestamp()
-        self.set_run_active(True)
-        self.trigger_logic.set_trigger_veto(False)
+        self.i2c.check_registers(tlu_registers)
+        with self.i2c.transaction():
+            self.reset_counters()
+            self.reset_fifo()
+            self.reset_timestamp()
+            run_active = self.set_run_active(True)
+            veto_state = self.trigger_logic.set_trigger_veto(False)
+        self.log_run_active(run_active)
+        self.trigger_logic.log_trigger_veto(veto_state)
 
     def stop_run(self) -> None:
         """Stop run configurations"""
-        self.trigger_logic.set_trigger_veto(True)
-        self.set_run_active(False)
+        with self.i2c.transaction():
+            veto_state = self.trigger_logic.set_trigger_veto(True)
+            run_active = self.set_run_active(False)
+        self.trigger_logic.log_trigger_veto(veto_state)
+        self.log_run_active(run_active)
 
     ### Basic TLU Control Functions ###
 
-    def write_clock_config(self, clock_config_path):
-        self.clock_controller.write_clock_conf(clock_config_path)
+    def write_clock_config(
+        self,
+        clock_config_path,
+        skip_unchanged: bool = False,
+        warm_start: bool = False,
+    ):
+        if warm_start and self.clock_controller.is_configured(clock_config_path):
+            self.log.info("Clock chip already configured, skip writing configuration")
+            return
+        self.clock_controller.write_clock_conf(clock_config_path, skip_unchanged)
 
     def get_device_id(self) -> int:
         """Read back board id. Consists of six blocks of hex data
@@ -75,10 +163,7 @@ class TLUControl:
         Returns:
             int: Board id as 48 bits integer
         """
-        id = []
-        for addr in range(6):
-            id.append(self.i2c.read(self.i2c.modules["eeprom"], 0xFA + addr) & 0xFF)
-        return int("0x" + "".join(["{:x}".format(i) for i in id]), 16) & 0xFFFFFFFFFFFF
+        return self.i2c.get_board_id()
 
     def get_fw_version(self) -> int:
         return self.i2c.read_register("version")
@@ -102,6 +187,7 @@ class TLUControl:
     def reset_fifo(self) -> None:
         """Sets 0 to 'EventFifoCSR' this resets the FIFO."""
         self.set_event_fifo_csr(0x0)
+        self._fifo_pending = 0
 
     def set_event_fifo_csr(self, value: int) -> None:
         """Sets value to the EventFifoCSR register.
@@ -120,16 +206,31 @@ class TLUControl:
         """
         self.i2c.write_register("triggerInputs.SerdesRstW", value)
 
-    def set_run_active(self, state: bool) -> None:
+    def set_run_active(self, state: bool) -> RegisterRead:
         """Raises internal run active signal.
+        Inside a transaction the read back is queued, the caller logs it after the dispatch with log_run_active.
 
         Args:
             state (bool): True sets run active, False disables it.
+
+        Returns:
+            RegisterRead: Deferred read back of the run active signal.
         """
         if type(state) != bool:
             raise TypeError("State has to be bool")
         self.i2c.write_register("Shutter.RunActiveRW", int(state))
-        self.log.info("Run active: %s" % self.get_run_active())
+        run_active = self.i2c.read_register_deferred("Shutter.RunActiveRW")
+        if not self.i2c.in_transaction:
+            self.log_run_active(run_active)
+        return run_active
+
+    def log_run_active(self, run_active: RegisterRead) -> None:
+        """Logs the read back of the run active signal.
+
+        Args:
+            run_active (RegisterRead): Deferred read of the run active register.
+        """
+        self.log.info("Run active: %s" % bool(run_active.value()))
 
     def get_run_active(self) -> bool:
         """Reads register 'RunActiveRW'
@@ -171,27 +272,81 @@ class TLUControl:
         Returns:
             int: Time stamp in 40MHz clock cycles.
         """
-        time = self.i2c.read_register("Event_Formatter.CurrentTimestampHR")
-        time = time << 32
-        time = time + self.i2c.read_register("Event_Formatter.CurrentTimestampLR")
+        with self.i2c.transaction():
+            time_high = self.i2c.read_register_deferred(
+                "Event_Formatter.CurrentTimestampHR"
+            )
+            time_low = self.i2c.read_register_deferred(
+                "Event_Formatter.CurrentTimestampLR"
+            )
+        time = time_high.value() << 32
+        time = time + time_low.value()
         return time
 
-    def pull_fifo_event(self) -> list:
-        """Pulls event from the FIFO. This is needed in the run loop to prevent the buffer to get stuck.
+    def get_status(self) -> TLUStatus:
+        """Reads timestamp, trigger counters, scalers and FIFO status in a single IPbus dispatch.
+
+        Returns:
+            TLUStatus: Immutable sample of the TLU counters.
+        """
+        with self.i2c.transaction():
+            time_high = self.i2c.read_register_deferred(
+                "Event_Formatter.CurrentTimestampHR"
+            )
+            time_low = self.i2c.read_register_deferred(
+                "Event_Formatter.CurrentTimestampLR"
+            )
+            pre_veto = self.i2c.read_register_deferred("triggerLogic.PreVetoTriggersR")
+            post_veto = self.i2c.read_register_deferred(
+                "triggerLogic.PostVetoTriggersR"
+            )
+            scalers = [
+                self.i2c.read_register_deferred(f"triggerInputs.ThrCount{n:d}R")
+                for n in range(6)
+            ]
+            fill_level = self.i2c.read_register_deferred(
+                "eventBuffer.EventFifoFillLevel"
+            )
+            csr = self.i2c.read_register_deferred("eventBuffer.EventFifoCSR")
+        return TLUStatus(
+            timestamp=(time_high.value() << 32) + time_low.value(),
+            pre_veto_triggers=pre_veto.value(),
+            post_veto_triggers=post_veto.value(),
+            scalers=tuple(scaler.value() for scaler in scalers),
+            fifo_fill_level=fill_level.value(),
+            fifo_csr=csr.value(),
+        )
+
+    @property
+    def fifo_fill_level(self) -> int:
+        """FIFO fill level read by the last pull_fifo_event, without accessing the TLU."""
+        return self._fifo_pending
+
+    def pull_fifo_event(self) -> np.ndarray | None:
+        """Pulls events from the FIFO. This is needed in the run loop to prevent the buffer to get stuck.
             if this register is full the fifo needs to be reset or new triggers are generated but not sent out.
             #TODO check here if the FIFO is full and reset it if needed would prob. make sense.
+            The block read of the words reported by the previous fill level read and the next
+            fill level read are sent in a single IPbus dispatch. Words arriving in between are read by the next call.
 
         Returns:
-            list: 6 element long vector containing bitwords of the data.
+            np.ndarray | None: uint32 array of the FIFO words, six words per event. None if there was no data.
         """
-        event_numb = self.get_event_fifo_fill_level()
-        if event_numb:
-            fifo_content = self.i2c_hw.getNode("eventBuffer.EventFifoData").readBlock(
-                event_numb
+        block = None
+        with self.i2c.transaction():
+            if self._fifo_pending:
+                block = self.i2c.read_register_block_deferred(
+                    "eventBuffer.EventFifoData", self._fifo_pending
+                )
+            fill_level = self.i2c.read_register_deferred(
+                "eventBuffer.EventFifoFillLevel"
             )
-            self.i2c_hw.dispatch()
-            return np.array(fifo_content)
-        pass
+        self._fifo_pending = max(fill_level.value(), 0)
+        if block is not None:
+            data = block.values()
+            if data.size:
+                return data
+        return None
 
     def get_scaler(self, channel: int) -> int:
         """reads current scaler value from register"""
@@ -205,7 +360,12 @@ class TLUControl:
         Returns:
             list: all 6 trigger sc values
         """
-        return [self.get_scaler(n) for n in range(6)]
+        with self.i2c.transaction():
+            scalers = [
+                self.i2c.read_register_deferred(f"triggerInputs.ThrCount{n:d}R")
+                for n in range(6)
+            ]
+        return [scaler.value() for scaler in scalers]
 
     def get_pre_veto_trigger_number(self) -> int:
         """Obtains the number of triggers recorded in the TLU before the veto is applied from the trigger logic register"""
@@ -225,6 +385,7 @@ class TLUConfigure:
 
     def configure(self) -> None:
         """Loads configuration file and configures the TLU accordingly."""
+        self.tlu.i2c.check_registers(tlu_registers)
         self.conf_dut()
         self.conf_trigger_inputs()
         self.conf_trigger_logic()
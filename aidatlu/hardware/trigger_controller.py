@@ -1,5 +1,5 @@
 from aidatlu import logger
-from aidatlu.hardware.i2c import I2CCore
+from aidatlu.hardware.i2c import I2CCore, RegisterRead
 from aidatlu.hardware.utils import _pack_bits
 
 
@@ -65,16 +65,33 @@ class TriggerLogic:
 
     ### Trigger Logic ###
 
-    def set_trigger_veto(self, veto: bool) -> None:
+    def set_trigger_veto(self, veto: bool) -> RegisterRead:
         """Enables or disables new trigger. This can be used to reset the procession of new triggers.
+        Inside a transaction the read back of the veto is queued, the caller logs it after the dispatch
+        with log_trigger_veto.
+
         Args:
             veto (bool): Sets a veto to the trigger logic of the tlu.
+
+        Returns:
+            RegisterRead: Deferred read back of the trigger veto.
         """
         if not isinstance(veto, bool):
             raise TypeError("Veto must be type bool")
 
         self.i2c.write_register("triggerLogic.TriggerVetoW", int(veto))
-        self.log.info("Trigger Veto set to: %s" % self.get_trigger_veto())
+        veto_state = self.i2c.read_register_deferred("triggerLogic.TriggerVetoR")
+        if not self.i2c.in_transaction:
+            self.log_trigger_veto(veto_state)
+        return veto_state
+
+    def log_trigger_veto(self, veto_state: RegisterRead) -> None:
+        """Logs the read back of the trigger veto.
+
+        Args:
+            veto_state (RegisterRead): Deferred read of the trigger veto.
+        """
+        self.log.info("Trigger Veto set to: %s" % bool(veto_state.value()))
 
     def set_trigger_polarity(self, value: int) -> int:
         """Sets if the TLU triggers on rising or falling edge.
@@ -99,15 +116,21 @@ class TriggerLogic:
             mask_high (int): The most significant 32-bit word generated from the trigger configuration.
             mask_low (int): The least significant 32-bit word generated from the trigger configuration.
         """
-        self.i2c.write_register("triggerLogic.TriggerPattern_lowW", mask_low)
-        self.i2c.write_register("triggerLogic.TriggerPattern_highW", mask_high)
+        with self.i2c.transaction():
+            self.i2c.write_register("triggerLogic.TriggerPattern_lowW", mask_low)
+            self.i2c.write_register("triggerLogic.TriggerPattern_highW", mask_high)
         self.log.debug("Trigger mask: %s" % self.get_trigger_mask())
 
     def get_trigger_mask(self) -> int:
         """Retrieves the trigger logic words from the registers. The trigger pattern represents one of the 64 possible logic combinations."""
-        mask_low = self.i2c.read_register("triggerLogic.TriggerPattern_lowR")
-        mask_high = self.i2c.read_register("triggerLogic.TriggerPattern_highR")
-        trigger_pattern = (mask_high << 32) | mask_low
+        with self.i2c.transaction():
+            mask_low = self.i2c.read_register_deferred(
+                "triggerLogic.TriggerPattern_lowR"
+            )
+            mask_high = self.i2c.read_register_deferred(
+                "triggerLogic.TriggerPattern_highR"
+            )
+        trigger_pattern = (mask_high.value() << 32) | mask_low.value()
         return trigger_pattern
 
     def get_trigger_veto(self) -> bool:
@@ -131,8 +154,9 @@ class TriggerLogic:
         """
         mask_high = (value >> 32) & 0xFF
         mask_low = value & 0xFF
-        self.i2c.write_register("triggerLogic.TriggerPattern_lowW", mask_low)
-        self.i2c.write_register("triggerLogic.TriggerPattern_highW", mask_high)
+        with self.i2c.transaction():
+            self.i2c.write_register("triggerLogic.TriggerPattern_lowW", mask_low)
+            self.i2c.write_register("triggerLogic.TriggerPattern_highW", mask_high)
         self.log.debug("Trigger mask: %s" % self.get_trigger_mask())
 
     ### Trigger Pulse Length and Delay ###
@@ -47,6 +47,8 @@ def yaml_parser(conf_file_path: str) -> dict:
         "pmt_control_3": yaml_conf["pmt_control"]["pmt_3"],
         "pmt_control_4": yaml_conf["pmt_control"]["pmt_4"],
         "save_data": yaml_conf["save_data"],
+        "online_interpretation": yaml_conf.get("online_interpretation", False),
+        "interpretation_workers": yaml_conf.get("interpretation_workers", 0),
         "output_data_path": yaml_conf["output_data_path"],
         "zmq_connection": yaml_conf["zmq_connection"],
         "max_trigger_number": yaml_conf["max_trigger_number"],
@@ -201,6 +203,18 @@ def toml_parser(
         conf["save_data"] = (
             False if toml_conf["save_data"] in ["False", "None", "off"] else True
         )
+        if "online_interpretation" not in keys:
+            conf["online_interpretation"] = False
+        else:
+            conf["online_interpretation"] = (
+                False
+                if toml_conf["online_interpretation"] in ["False", "None", "off"]
+                else True
+            )
+        if "interpretation_workers" not in keys:
+            conf["interpretation_workers"] = 0
+        else:
+            conf["interpretation_workers"] = toml_conf["interpretation_workers"]
 
     else:
         conf["output_data_path"] = None
@@ -208,5 +222,7 @@ def toml_parser(
         conf["max_trigger_number"] = None
         conf["timeout"] = None
         conf["save_data"] = False
+        conf["online_interpretation"] = False
+        conf["interpretation_workers"] = 0
 
     return conf
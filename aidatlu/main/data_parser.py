@@ -1,48 +1,104 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Iterator
 
 import numpy as np
 import tables as tb
 from tqdm import tqdm
 
 from aidatlu import logger
+from aidatlu.main.readout import EventFramer, ResyncFramer
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Output format of the interpreted data
+FEATURES = np.dtype(
+    [
+        ("eventnumber", "u4"),
+        ("timestamp", "u8"),
+        ("overflow", "u8"),
+        ("eventtype", "u4"),
+        ("input1", "bool"),
+        ("input2", "bool"),
+        ("input3", "bool"),
+        ("input4", "bool"),
+        ("input5", "bool"),
+        ("input6", "bool"),
+        ("sc1", "u4"),
+        ("sc2", "u4"),
+        ("sc3", "u4"),
+        ("sc4", "u4"),
+        ("sc5", "u4"),
+        ("sc6", "u4"),
+    ]
+)
+CONF_DTYPE = np.dtype(
+    [
+        ("attribute", "S32"),
+        ("value", "S32"),
+    ]
+)
+# Timestamps and rows of the interpreted events, PyTables can not index uint64 columns
+TIMESTAMP_INDEX_DTYPE = np.dtype(
+    [
+        ("timestamp", "i8"),
+        ("row", "i8"),
+    ]
+)
+# Raw word positions of quarantined segments
+QUARANTINE_DTYPE = np.dtype(
+    [
+        ("start", "u8"),
+        ("stop", "u8"),
+    ]
+)
 
 
 def interpret_data(
     filepath_in: str | Path,
     filepath_out: str | Path = None,
     chunk_size: int = 1000000,
+    n_processes: int = 1,
+    incremental: bool = False,
+    resync: bool = False,
+    create_index: bool = False,
 ) -> None:
     """Interprets raw tlu data. The data is interpreted in chunksizes.
     The data is parsed form filepath_in to filepath_out.
     An event consists of six consecutive raw data entries the last entry should be always 0.
     The raw data is sliced and the last data entry checked for corrupted data.
+    With more than one process the chunks are read and decoded in parallel and written in order.
+    Receiving and compressing the events for the output file stays in the calling process, which limits the
+    speed-up to about a factor of two independent of the number of processes.
+    The number of consumed raw words is stored in the attributes of the interpreted data table.
+    In incremental mode only the raw words added since the last call are interpreted and appended,
+    so a file that is still written can be followed. Reading a file while the TLU writes it requires
+    disabling the HDF5 file locking with the environment variable HDF5_USE_FILE_LOCKING=FALSE.
+    With resync the word stream is resynchronized after corrupted or missing words. The positions of the
+    skipped words are stored in the quarantine table, their number in the attributes of the interpreted data table.
+    In incremental mode a segment at the end of the interpreted words is stored with the next call.
+    With create_index completely sorted indexes of the event numbers and timestamps are built for fast queries.
 
     Args:
         filepath_in (str | Path): raw data file path as string or Path object
         filepath_out (str | Path): output path of the interpreted data as string or Path object
+        chunk_size (int, optional): Number of events per chunk. Defaults to 1000000.
+        n_processes (int, optional): Number of processes decoding the chunks. Defaults to 1.
+        incremental (bool, optional): Continue an existing interpreted file. Defaults to False.
+        resync (bool, optional): Resynchronize the data after corrupted words, runs in a single process.
+            Defaults to False.
+        create_index (bool, optional): Build indexes of the event numbers and timestamps. Indexes of a continued
+            file are extended independent of this option. Defaults to False.
     """
+    if n_processes < 1:
+        raise ValueError("At least one process is needed")
     log = logger.setup_derived_logger("Data Interpreter")
-    features = np.dtype(
-        [
-            ("eventnumber", "u4"),
-            ("timestamp", "u8"),
-            ("overflow", "u8"),
-            ("eventtype", "u4"),
-            ("input1", "bool"),
-            ("input2", "bool"),
-            ("input3", "bool"),
-            ("input4", "bool"),
-            ("input5", "bool"),
-            ("input6", "bool"),
-            ("sc1", "u4"),
-            ("sc2", "u4"),
-            ("sc3", "u4"),
-            ("sc4", "u4"),
-            ("sc5", "u4"),
-            ("sc6", "u4"),
-        ]
-    )
-    raw_features = np.dtype([("raw", "u4")])
+    features = FEATURES
 
     log.info("Interpreting Data")
     chunk_size = chunk_size * 6
@@ -58,42 +114,306 @@ def interpret_data(
             log.warning("Data is empty. Skip analysis!")
             return
 
-        with tb.open_file(filepath_out, mode="w", title="TLU_interpreted") as out_file:
-            data_table = _create_table(
-                out_file, name="interpreted_data", title="data", dtype=features
-            )
-            for chunk in tqdm(range(0, n_words, chunk_size)):
-                chunk_offset = chunk
-                stop = chunk_offset + chunk_size
-                if chunk + chunk_size > n_words:
-                    stop = n_words
-                table = in_file.root.raw_data[chunk_offset:stop]
-                raw_data = np.array(table[:], dtype=raw_features)
-                data = _transform_data(
-                    raw_data["raw"][::6],
-                    raw_data["raw"][1::6],
-                    raw_data["raw"][2::6],
-                    raw_data["raw"][3::6],
-                    raw_data["raw"][4::6],
-                    raw_data["raw"][5::6],
-                    log,
-                    features,
+        if n_words % 6 and not resync:
+            if incremental:
+                # The rest of the event is not written yet
+                log.debug("Skipped %i words of an incomplete event" % (n_words % 6))
+            else:
+                log.warning("Discarded %i words of an incomplete event" % (n_words % 6))
+            n_words -= n_words % 6
+
+        start_word = 0
+        if incremental and Path(filepath_out).exists():
+            start_word = _consumed_raw_words(filepath_in, filepath_out, n_words, log)
+            if start_word == n_words:
+                log.info("No new data in %s" % filepath_in)
+                return
+
+        with tb.open_file(
+            filepath_out, mode="a" if start_word else "w", title="TLU_interpreted"
+        ) as out_file:
+            if start_word:
+                data_table = out_file.root.interpreted_data
+            else:
+                data_table = _create_table(
+                    out_file, name="interpreted_data", title="data", dtype=features
                 )
+            ranges = [
+                (start, min(start + chunk_size, n_words))
+                for start in range(start_word, n_words, chunk_size)
+            ]
+            if resync:
+                if n_processes > 1:
+                    log.info("Resynchronization runs in a single process")
+                framer = ResyncFramer(
+                    offset=start_word,
+                    linked=bool(getattr(data_table.attrs, "resync_linked", False)),
+                    open_segment=getattr(data_table.attrs, "resync_open_segment", None),
+                )
+                if "quarantine" in out_file.root:
+                    quarantine_table = out_file.root.quarantine
+                else:
+                    quarantine_table = _create_table(
+                        out_file,
+                        name="quarantine",
+                        title="quarantined raw words",
+                        dtype=QUARANTINE_DTYPE,
+                    )
+                chunks = _decode_resync(
+                    in_file.root.raw_data,
+                    ranges,
+                    framer,
+                    quarantine_table,
+                    final=not incremental,
+                )
+            elif n_processes > 1 and len(ranges) > 1:
+                chunks = _decode_parallel(filepath_in, ranges, n_processes)
+            else:
+                chunks = _decode_serial(in_file.root.raw_data, ranges)
+            for data in tqdm(chunks, total=len(ranges)):
                 data_table.append(data)
+            data_table.attrs.raw_file = Path(filepath_in).name
+            data_table.attrs.consumed_raw_words = n_words
+            if resync:
+                # Words kept by the framer are interpreted with the next words
+                data_table.attrs.consumed_raw_words = n_words - framer.n_remainder
+                data_table.attrs.resync_linked = framer.linked
+                data_table.attrs.resync_open_segment = framer.open_segment
+                data_table.attrs.n_quarantined_segments = (
+                    getattr(data_table.attrs, "n_quarantined_segments", 0)
+                    + framer.n_quarantined_segments
+                )
+                data_table.attrs.n_quarantined_words = (
+                    getattr(data_table.attrs, "n_quarantined_words", 0)
+                    + framer.n_quarantined_words
+                )
+                if framer.n_quarantined_segments:
+                    log.warning(
+                        "Quarantined %i corrupted words in %i segments"
+                        % (framer.n_quarantined_words, framer.n_quarantined_segments)
+                    )
+
+            if "conf" not in out_file.root:
+                config_table = out_file.create_table(
+                    out_file.root,
+                    name="conf",
+                    description=CONF_DTYPE,
+                )
+                config_table.append(conf)
+
+            if create_index or "timestamp_index" in out_file.root:
+                # Existing indexes always cover all events
+                create_indexes(out_file, chunk_size=chunk_size // 6)
+    log.success('Data parsed from "%s" to "%s"' % (filepath_in, filepath_out))
+
+
+def create_indexes(out_file: tb.File, chunk_size: int = 1000000) -> None:
+    """Builds completely sorted indexes of the event numbers and timestamps of the interpreted data.
+    PyTables can not index uint64 columns, the timestamps are indexed in the timestamp_index table
+    with the row of each event. Indexes of a continued file are extended by the new events.
+
+    Args:
+        out_file (tb.File): Interpreted data file opened for writing.
+        chunk_size (int, optional): Number of events per chunk. Defaults to 1000000.
+    """
+    data_table = out_file.root.interpreted_data
+    if "timestamp_index" in out_file.root:
+        index_table = out_file.root.timestamp_index
+    else:
+        index_table = _create_table(
+            out_file,
+            name="timestamp_index",
+            title="timestamp index",
+            dtype=TIMESTAMP_INDEX_DTYPE,
+        )
+    for start in range(index_table.nrows, data_table.nrows, chunk_size):
+        stop = min(start + chunk_size, data_table.nrows)
+        rows = np.empty(stop - start, dtype=TIMESTAMP_INDEX_DTYPE)
+        rows["timestamp"] = data_table.read(start, stop, field="timestamp")
+        rows["row"] = np.arange(start, stop)
+        index_table.append(rows)
+    for column in [data_table.cols.eventnumber, index_table.cols.timestamp]:
+        if not column.is_indexed:
+            column.create_csindex()
+        elif not column.index.is_csi:
+            column.reindex()
+
+
+def _consumed_raw_words(
+    filepath_in: str | Path, filepath_out: str | Path, n_words: int, log: logger
+) -> int:
+    """Number of raw words already interpreted to an existing interpreted file.
+
+    Args:
+        filepath_in (str | Path): raw data file path as string or Path object
+        filepath_out (str | Path): output path of the interpreted data as string or Path object
+        n_words (int): Number of complete raw words in the raw data file.
+        log (logger): logging function
+
+    Returns:
+        int: Consumed raw words, 0 if the file has to be interpreted from the start.
+    """
+    with tb.open_file(filepath_out, "r") as out_file:
+        if "interpreted_data" not in out_file.root:
+            return 0
+        attrs = out_file.root.interpreted_data.attrs
+        raw_file = getattr(attrs, "raw_file", None)
+        consumed_raw_words = int(getattr(attrs, "consumed_raw_words", 0))
+    if raw_file != Path(filepath_in).name or consumed_raw_words > n_words:
+        log.warning(
+            "%s is not an interpretation of %s, interpreting from the start"
+            % (filepath_out, filepath_in)
+        )
+        return 0
+    return consumed_raw_words
+
+
+def _decode_serial(raw_table: tb.Table, ranges: list) -> Iterator[np.ndarray]:
+    """Decodes the raw data table chunk by chunk.
+
+    Args:
+        raw_table (tb.Table): Raw data table.
+        ranges (list): Start and stop word of each chunk, aligned to the six word events.
+
+    Yields:
+        np.ndarray: Interpreted events of a chunk.
+    """
+    decoder = EventDecoder()
+    for start, stop in ranges:
+        raw_data = raw_table.read(start, stop, field="raw")
+        yield decoder.decode(raw_data.reshape(-1, 6))
+
+
+def _decode_resync(
+    raw_table: tb.Table,
+    ranges: list,
+    framer: ResyncFramer,
+    quarantine_table: tb.Table,
+    final: bool,
+) -> Iterator[np.ndarray]:
+    """Resynchronizes and decodes the raw data table chunk by chunk.
+
+    Args:
+        raw_table (tb.Table): Raw data table.
+        ranges (list): Start and stop word of each chunk.
+        framer (ResyncFramer): Framer of the word stream.
+        quarantine_table (tb.Table): Table of the quarantined segments.
+        final (bool): The last chunk is the end of the data.
+
+    Yields:
+        np.ndarray: Interpreted events of a chunk.
+    """
+    decoder = EventDecoder()
+    for index, (start, stop) in enumerate(ranges):
+        events, segments = framer.frame(
+            raw_table.read(start, stop, field="raw"),
+            final=final and index == len(ranges) - 1,
+        )
+        if segments.size:
+            quarantine_table.append(segments)
+        yield decoder.decode(events)
+
+
+def _decode_parallel(
+    filepath_in: str | Path, ranges: list, n_processes: int
+) -> Iterator[np.ndarray]:
+    """Decodes chunks of the raw data file in a process pool. Each process reads its chunks from the file.
+    The number of chunks in flight is limited, so finished chunks do not pile up in memory.
+    The decoded chunks are transferred to the calling process, which appends them to the output table.
+    Only a single process can write the HDF5 file, so transferring and compressing the events is not parallelized.
 
-            config = np.dtype(
-                [
-                    ("attribute", "S32"),
-                    ("value", "S32"),
-                ]
+    Args:
+        filepath_in (str | Path): raw data file path as string or Path object
+        ranges (list): Start and stop word of each chunk, aligned to the six word events.
+        n_processes (int): Number of processes.
+
+    Yields:
+        np.ndarray: Interpreted events of a chunk, in order of the chunks.
+    """
+    with ProcessPoolExecutor(
+        max_workers=n_processes, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        pending = deque()
+        for start, stop in ranges:
+            pending.append(executor.submit(_decode_range, filepath_in, start, stop))
+            if len(pending) >= 2 * n_processes:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _decode_range(filepath_in: str | Path, start: int, stop: int) -> np.ndarray:
+    """Reads and decodes a chunk of the raw data file, executed in the worker processes.
+
+    Args:
+        filepath_in (str | Path): raw data file path as string or Path object
+        start (int): First word of the chunk.
+        stop (int): Word after the chunk.
+
+    Returns:
+        np.ndarray: Interpreted events of the chunk.
+    """
+    with tb.open_file(filepath_in, "r") as in_file:
+        raw_data = in_file.root.raw_data.read(start, stop, field="raw")
+    return EventDecoder().decode(raw_data.reshape(-1, 6))
+
+
+class StreamInterpreter:
+    """Interprets raw FIFO words during the run and appends the events to the interpreted data table.
+    The interpreted file has the same content as the one from interpret_data and is complete as soon as the run stops.
+    """
+
+    def __init__(self, filepath_out: str | Path) -> None:
+        """
+        Args:
+            filepath_out (str | Path): output path of the interpreted data as string or Path object
+        """
+        self.log = logger.setup_derived_logger("Data Interpreter")
+        self.filepath_out = filepath_out
+        self.framer = EventFramer()
+        self.decoder = EventDecoder()
+        self.n_events = 0
+        self.out_file = tb.open_file(filepath_out, mode="w", title="TLU_interpreted")
+        self.data_table = _create_table(
+            self.out_file, name="interpreted_data", title="data", dtype=FEATURES
+        )
+
+    def append(self, words: np.ndarray) -> None:
+        """Interprets a block of raw FIFO words, words of an incomplete event are kept for the next block.
+
+        Args:
+            words (np.ndarray): Raw FIFO words.
+        """
+        events = self.framer.frame(words)
+        if not events.size:
+            return
+        data = self.decoder.decode(events)
+        self.data_table.append(data)
+        self.n_events += data.shape[0]
+
+    def close(self, conf: list | np.ndarray | None = None) -> None:
+        """Writes the configuration table and closes the interpreted data file.
+
+        Args:
+            conf (list | np.ndarray | None, optional): Configuration table of the run. Defaults to None.
+        """
+        if not self.out_file.isopen:
+            return
+        if self.framer.n_remainder:
+            self.log.warning(
+                "Discarded %i words of an incomplete event" % self.framer.n_remainder
             )
-            config_table = out_file.create_table(
-                out_file.root,
+        if conf is not None:
+            config_table = self.out_file.create_table(
+                self.out_file.root,
                 name="conf",
-                description=config,
+                description=CONF_DTYPE,
             )
             config_table.append(conf)
-    log.success('Data parsed from "%s" to "%s"' % (filepath_in, filepath_out))
+        self.out_file.close()
+        self.log.success(
+            'Interpreted %i events to "%s"' % (self.n_events, self.filepath_out)
+        )
 
 
 def _create_table(out_file, name, title, dtype):
@@ -110,58 +430,135 @@ def _create_table(out_file, name, title, dtype):
     return table
 
 
-def _transform_data(
-    w0: np.array,
-    w1: np.array,
-    w2: np.array,
-    w3: np.array,
-    w4: np.array,
-    w5: np.array,
-    log: logger,
-    features: np.dtype,
-) -> np.array:
-    """Transforms raw data from the FIFO to a readable dataformat
+class EventDecoder:
+    """Decodes framed events of six raw FIFO words to the interpreted data format.
+    The output buffer is reused between calls, the returned array is only valid until the next call.
+    If numba is installed, the events are decoded with a compiled kernel in a single pass.
+    """
 
-    Args:
-        w0 (np.array): contains information which trigger input fired
-        w1 (np.array): contains timestamp information
-        w2 (np.array): trigger input information
-        w3 (np.array): eventnumber
-        w4 (np.array): trigger input information
-        w5 (np.array): this should always be 0.
-        log (logger): logging function
-        features (dtype): output array dtype structure
+    def __init__(self, use_numba: bool | None = None) -> None:
+        """
+        Args:
+            use_numba (bool | None, optional): Use the compiled kernel, None uses it if numba is installed. Defaults to None.
+        """
+        if use_numba and numba is None:
+            raise RuntimeError("numba is not installed")
+        self.log = logger.setup_derived_logger("Data Interpreter")
+        self.use_numba = numba is not None if use_numba is None else use_numba
+        self._allocate(1)
 
-    Returns:
-        np.array: array with columns
+    def decode(self, events: np.ndarray) -> np.ndarray:
+        """Decodes events to the interpreted data format.
+
+        Args:
+            events (np.ndarray): Raw events of shape (N, 6).
+
+        Returns:
+            np.ndarray: N interpreted events, view of the reused output buffer.
+        """
+        # Little-endian words, so the bytes of the words can be addressed directly
+        events = np.ascontiguousarray(events, dtype="<u4").reshape(-1, 6)
+        n_events = events.shape[0]
+        if np.any(events[:, 5]):
+            self.log.warning("Corrupted Data found")
+        if n_events > self._out.shape[0]:
+            self._allocate(n_events)
+        out = self._out[:n_events]
+        inputs = self._inputs[:n_events]
+        scalers = self._scalers[:n_events]
+
+        if self.use_numba:
+            _decode_kernel_compiled(
+                events,
+                out["eventnumber"],
+                out["timestamp"],
+                out["overflow"],
+                out["eventtype"],
+                inputs,
+                scalers,
+            )
+            return out
+
+        w0_bytes = events[:, 0:1].view(np.uint8)
+        out["eventnumber"] = events[:, 3]
+        # The upper 16 bits of the timestamp are masked off by (w0 & 0x0000FFFF << 32)
+        out["timestamp"] = events[:, 1]
+        out["overflow"] = events[:, 0:1].view("<u2")[:, 0]
+        out["eventtype"] = w0_bytes[:, 3] >> 4
+        # Which trigger input produced the event, bits 16 to 21 of w0.
+        inputs[:] = np.unpackbits(w0_bytes[:, 2:3], axis=1, bitorder="little")[:, :6]
+        # Finer timestamp for each trigger input sampled with double data rate 640MHz clock (0.78125 ns),
+        # bytes 3 to 0 of w2 and bytes 3 and 2 of w4.
+        scalers[:, :4] = events[:, 2:3].view(np.uint8)[:, ::-1]
+        scalers[:, 4:] = events[:, 4:5].view(np.uint8)[:, 3:1:-1]
+        return out
+
+    def _allocate(self, n_events: int) -> None:
+        """Allocates the output buffer and the views of the input flags and fine timestamps.
+
+        Args:
+            n_events (int): Number of events of the buffer.
+        """
+        n_events = max(n_events, 1)
+        self._out = np.empty(n_events, dtype=FEATURES)
+        # input1 to input6 and sc1 to sc6 are consecutive fields, addressed as (N, 6) arrays
+        self._inputs = np.ndarray(
+            (n_events, 6),
+            dtype=np.bool_,
+            buffer=self._out,
+            offset=FEATURES.fields["input1"][1],
+            strides=(FEATURES.itemsize, 1),
+        )
+        self._scalers = np.ndarray(
+            (n_events, 6),
+            dtype=np.uint32,
+            buffer=self._out,
+            offset=FEATURES.fields["sc1"][1],
+            strides=(FEATURES.itemsize, 4),
+        )
+
+
+def _decode_kernel(
+    events: np.ndarray,
+    eventnumber: np.ndarray,
+    timestamp: np.ndarray,
+    overflow: np.ndarray,
+    eventtype: np.ndarray,
+    inputs: np.ndarray,
+    scalers: np.ndarray,
+) -> None:
+    """Decodes events in a single pass, compiled with numba if available.
+
+    Args:
+        events (np.ndarray): Raw events of shape (N, 6).
+        eventnumber (np.ndarray): Output event numbers.
+        timestamp (np.ndarray): Output timestamps.
+        overflow (np.ndarray): Output timestamp overflow.
+        eventtype (np.ndarray): Output event types.
+        inputs (np.ndarray): Output trigger input flags of shape (N, 6).
+        scalers (np.ndarray): Output fine timestamps of shape (N, 6).
     """
-    if np.any(w5) != 0:
-        log.warning("Corrupted Data found")
-
-    # Cast w0 to uint64 for concatenating 2 x 32bit to 64bit later
-    w0 = w0.astype(np.uint64)
-
-    out_array = np.zeros(len(w3), dtype=features)
-    out_array["eventnumber"] = w3
-    out_array["timestamp"] = (w0 & 0x0000FFFF << 32) + w1
-    out_array["overflow"] = w0 & 0xFFFF
-    # TODO not sure what this is per. mode?
-    out_array["eventtype"] = (w0 >> 28) & 0xF
-    # Which trigger input produced the event.
-    out_array["input1"] = (w0 >> 16) & 0x1
-    out_array["input2"] = (w0 >> 17) & 0x1
-    out_array["input3"] = (w0 >> 18) & 0x1
-    out_array["input4"] = (w0 >> 19) & 0x1
-    out_array["input5"] = (w0 >> 20) & 0x1
-    out_array["input6"] = (w0 >> 21) & 0x1
-    # Finer timestamp for each trigger input sampled with double data rate 640MHz clock (0.78125 ns)
-    out_array["sc1"] = (w2 >> 24) & 0xFF
-    out_array["sc2"] = (w2 >> 16) & 0xFF
-    out_array["sc3"] = (w2 >> 8) & 0xFF
-    out_array["sc4"] = w2 & 0xFF
-    out_array["sc5"] = (w4 >> 24) & 0xFF
-    out_array["sc6"] = (w4 >> 16) & 0xFF
-    return out_array
+    for i in range(events.shape[0]):
+        w0 = events[i, 0]
+        w2 = events[i, 2]
+        w4 = events[i, 4]
+        eventnumber[i] = events[i, 3]
+        timestamp[i] = events[i, 1]
+        overflow[i] = w0 & 0xFFFF
+        eventtype[i] = (w0 >> 28) & 0xF
+        for j in range(6):
+            inputs[i, j] = ((w0 >> (16 + j)) & 0x1) != 0
+        scalers[i, 0] = (w2 >> 24) & 0xFF
+        scalers[i, 1] = (w2 >> 16) & 0xFF
+        scalers[i, 2] = (w2 >> 8) & 0xFF
+        scalers[i, 3] = w2 & 0xFF
+        scalers[i, 4] = (w4 >> 24) & 0xFF
+        scalers[i, 5] = (w4 >> 16) & 0xFF
+
+
+_decode_kernel_compiled = (
+    numba.njit(nogil=True, cache=True)(_decode_kernel) if numba is not None else None
+)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+from pathlib import Path
+
+import numpy as np
+import tables as tb
+
+
+class InterpretedData:
+    """Queries events of an interpreted data file. The queries are in-kernel searches,
+    which use the indexes of the event numbers and timestamps if the file was interpreted with create_index.
+    """
+
+    def __init__(self, filepath: str | Path) -> None:
+        """
+        Args:
+            filepath (str | Path): path of the interpreted data as string or Path object
+        """
+        self.file = tb.open_file(filepath, "r")
+        self.data_table = self.file.root.interpreted_data
+
+    def __enter__(self) -> "InterpretedData":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Closes the interpreted data file."""
+        self.file.close()
+
+    @property
+    def indexed(self) -> bool:
+        """The file has indexes of the event numbers and timestamps."""
+        return (
+            "timestamp_index" in self.file.root
+            and self.data_table.cols.eventnumber.is_indexed
+        )
+
+    def get_event(self, number: int) -> np.void:
+        """Event with the given event number.
+
+        Args:
+            number (int): Event number.
+
+        Returns:
+            np.void: Interpreted event.
+        """
+        events = self.data_table.read_where(
+            "eventnumber == number", condvars={"number": np.uint32(number)}
+        )
+        if not events.size:
+            raise KeyError("No event with event number %i" % number)
+        return events[0]
+
+    def get_events(self, tmin: int, tmax: int) -> np.ndarray:
+        """Events with tmin <= timestamp < tmax, in the order of the file.
+
+        Args:
+            tmin (int): Start of the time window in units of the timestamp (25ns clock cycles).
+            tmax (int): End of the time window in units of the timestamp (25ns clock cycles).
+
+        Returns:
+            np.ndarray: Interpreted events.
+        """
+        events = []
+        start = 0
+        if "timestamp_index" in self.file.root:
+            index_table = self.file.root.timestamp_index
+            rows = index_table.read_where(
+                "(timestamp >= tmin) & (timestamp < tmax)",
+                condvars={"tmin": np.int64(tmin), "tmax": np.int64(tmax)},
+                field="row",
+            )
+            rows.sort()
+            events.append(self.data_table.read_coordinates(rows))
+            # Events appended without extending the index are scanned
+            start = index_table.nrows
+        # uint64 columns can not be searched in-kernel, the table is scanned in chunks
+        chunk_size = self.data_table.chunkshape[0] * 1024
+        for chunk_start in range(start, self.data_table.nrows, chunk_size):
+            chunk = self.data_table.read(chunk_start, chunk_start + chunk_size)
+            events.append(
+                chunk[(chunk["timestamp"] >= tmin) & (chunk["timestamp"] < tmax)]
+            )
+        if not events:
+            return np.empty(0, dtype=self.data_table.dtype)
+        return np.concatenate(events)
@@ -0,0 +1,242 @@
+import queue
+import threading
+import time
+
+import numpy as np
+import tables as tb
+
+from aidatlu import logger
+
+
+class DataWriter:
+    """Writes raw FIFO words to the raw data table in a separate thread.
+    The readout puts word blocks into a bounded queue, so compression and disk stalls
+    of the HDF5 file do not delay the next FIFO read. The writer collects the words in a
+    preallocated buffer and appends them to the table in large blocks of complete events,
+    when the buffer is full or the flush interval has passed.
+    """
+
+    def __init__(
+        self,
+        table: tb.Table,
+        max_queue_size: int = 10000,
+        put_timeout: float | None = None,
+        buffer_size: int = 6 * 2**18,
+        flush_interval: float = 1.0,
+        interpreter=None,
+    ) -> None:
+        """
+        Args:
+            table (tb.Table): Raw data table.
+            max_queue_size (int, optional): Maximum number of word blocks in the queue. Defaults to 10000.
+            put_timeout (float | None, optional): Time in seconds the readout waits for a full queue before
+                the block is dropped. None waits until there is space again, no data is dropped while the writer thread
+                is running. Defaults to None.
+            buffer_size (int, optional): Size of the word buffer, should be a multiple of the six word event size.
+                Defaults to 1572864 words.
+            flush_interval (float, optional): Maximum time in seconds words stay in the buffer. Defaults to 1.0.
+            interpreter (StreamInterpreter, optional): Interprets the words after they are appended to the table.
+                Defaults to None.
+        """
+        self.log = logger.setup_derived_logger(__class__.__name__)
+        self.table = table
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.put_timeout = put_timeout
+        self.buffer = np.empty(buffer_size, dtype=np.uint32)
+        self.flush_interval = flush_interval
+        self.interpreter = interpreter
+        self._n_buffered = 0
+        self._last_flush = time.time()
+        # Queue statistics
+        self.high_water_mark = 0
+        self.n_stalls = 0
+        self.n_dropped = 0
+        self.n_blocks = 0
+        self.n_words = 0
+        self.n_flushes = 0
+        self._thread = None
+
+    @property
+    def depth(self) -> int:
+        """Number of word blocks waiting in the queue."""
+        return self.queue.qsize()
+
+    def start(self) -> None:
+        """Starts the writer thread."""
+        self._thread = threading.Thread(target=self._run, name="DataWriter")
+        self._thread.start()
+
+    def put(self, words: np.ndarray) -> bool:
+        """Puts a block of FIFO words into the queue. Called by the readout.
+
+        Args:
+            words (np.ndarray): Raw FIFO words.
+
+        Returns:
+            bool: False if the block was dropped.
+        """
+        if self._died():
+            self.n_dropped += 1
+            self.log.warning(
+                "Data writer stopped, dropped %i FIFO words" % np.size(words)
+            )
+            return False
+        try:
+            self.queue.put_nowait(words)
+        except queue.Full:
+            # The writer can not keep up, the readout has to wait
+            self.n_stalls += 1
+            if not self._put_waiting(words, self.put_timeout):
+                self.n_dropped += 1
+                self.log.warning(
+                    "Data queue full, dropped %i FIFO words" % np.size(words)
+                )
+                return False
+        self.high_water_mark = max(self.high_water_mark, self.queue.qsize())
+        return True
+
+    def stop(self) -> None:
+        """Writes all queued blocks and stops the writer thread."""
+        if self._thread is None:
+            return
+        if not self._put_waiting(None, None):
+            self.log.error(
+                "Data writer stopped early, %i queued blocks not written" % self.depth
+            )
+        self._thread.join()
+        self._thread = None
+        self.log.debug("Data writer statistics: %s" % self.get_statistics())
+
+    def _died(self) -> bool:
+        """True if the writer thread was started and has ended."""
+        return self._thread is not None and not self._thread.is_alive()
+
+    def _put_waiting(self, item, timeout: float | None) -> bool:
+        """Waits for space in the queue, gives up if the writer thread has ended.
+
+        Args:
+            item: Block of FIFO words or the stop marker.
+            timeout (float | None): Maximum waiting time in seconds, None waits while the writer thread is running.
+
+        Returns:
+            bool: True if the item was put into the queue.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            wait = 0.1 if deadline is None else min(deadline - time.time(), 0.1)
+            try:
+                self.queue.put(item, timeout=max(wait, 0))
+                return True
+            except queue.Full:
+                if self._died() or (deadline is not None and time.time() >= deadline):
+                    return False
+
+    def get_statistics(self) -> dict:
+        """Queue and write statistics.
+
+        Returns:
+            dict: Queue depth, high-water mark, stall and drop counters, received blocks and words and table appends.
+        """
+        return {
+            "depth": self.depth,
+            "high_water_mark": self.high_water_mark,
+            "stalls": self.n_stalls,
+            "dropped": self.n_dropped,
+            "blocks": self.n_blocks,
+            "words": self.n_words,
+            "flushes": self.n_flushes,
+        }
+
+    def _run(self) -> None:
+        """Writer thread, drains the queue until the stop marker is received.
+        All buffered words are written before the thread ends.
+        """
+        while True:
+            timeout = self.flush_interval - (time.time() - self._last_flush)
+            try:
+                words = self.queue.get(timeout=max(timeout, 0))
+            except queue.Empty:
+                self._try_flush()
+                continue
+            if words is None:
+                break
+            try:
+                self._write(words)
+            except Exception as e:
+                self.n_dropped += 1
+                self.log.error("Writing FIFO words failed: %s" % e)
+            if time.time() - self._last_flush >= self.flush_interval:
+                self._try_flush()
+        try:
+            self._flush()
+            self.table.flush()
+        except Exception as e:
+            self.log.error(
+                "Writing the last %i FIFO words failed: %s" % (self._n_buffered, e)
+            )
+
+    def _try_flush(self) -> None:
+        """Flushes the complete events of the buffer. Errors are logged,
+        the words stay in the buffer and are written with the next flush.
+        """
+        try:
+            self._flush(aligned=True)
+        except Exception as e:
+            self._last_flush = time.time()
+            self.log.error("Flushing FIFO words failed: %s" % e)
+
+    def _write(self, words: np.ndarray) -> None:
+        """Copies a block of FIFO words into the buffer, the buffer is flushed if it is full.
+
+        Args:
+            words (np.ndarray): Raw FIFO words.
+        """
+        words = np.asarray(words, dtype=np.uint32).ravel()
+        self.n_blocks += 1
+        self.n_words += words.size
+        if self._n_buffered + words.size > self.buffer.size:
+            self._flush(aligned=True)
+        if self._n_buffered + words.size > self.buffer.size:
+            # Block larger than the buffer
+            self._append(
+                np.concatenate((self.buffer[: self._n_buffered], words)),
+            )
+            self._n_buffered = 0
+            return
+        self.buffer[self._n_buffered : self._n_buffered + words.size] = words
+        self._n_buffered += words.size
+
+    def _flush(self, aligned: bool = False) -> None:
+        """Appends the buffered words to the raw data table.
+
+        Args:
+            aligned (bool, optional): Only write complete six word events, the remaining words stay in the buffer.
+                Defaults to False.
+        """
+        n_words = self._n_buffered
+        if aligned:
+            n_words -= n_words % 6
+        if n_words:
+            self._append(self.buffer[:n_words])
+            n_remaining = self._n_buffered - n_words
+            self.buffer[:n_remaining] = self.buffer[n_words : self._n_buffered]
+            self._n_buffered = n_remaining
+            # Makes the words visible to readers of the file during the run
+            self.table.flush()
+        self._last_flush = time.time()
+
+    def _append(self, words: np.ndarray) -> None:
+        """Appends words to the raw data table.
+
+        Args:
+            words (np.ndarray): Raw FIFO words.
+        """
+        self.table.append(words)
+        self.n_flushes += 1
+        if self.interpreter is not None:
+            try:
+                self.interpreter.append(words)
+            except Exception as e:
+                # The raw data is complete, it can still be interpreted after the run
+                self.log.error("Online interpretation failed: %s" % e)
+                self.interpreter = None
@@ -0,0 +1,158 @@
+import concurrent.futures
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+from aidatlu import logger
+from aidatlu.main.data_parser import interpret_data
+
+
+class InterpretationJob:
+    """Interpretation of a single raw data file, submitted to the InterpretationQueue."""
+
+    def __init__(
+        self,
+        job_id: int,
+        filepath_in: str | Path,
+        filepath_out: str | Path,
+        future: Future,
+    ) -> None:
+        self.job_id = job_id
+        self.filepath_in = filepath_in
+        self.filepath_out = filepath_out
+        self.future = future
+
+    @property
+    def status(self) -> str:
+        """Job status: 'pending', 'running', 'cancelled', 'failed' or 'done'."""
+        if self.future.cancelled():
+            return "cancelled"
+        if self.future.running():
+            return "running"
+        if not self.future.done():
+            return "pending"
+        return "failed" if self.future.exception() is not None else "done"
+
+    @property
+    def error(self) -> BaseException | None:
+        """Exception of a failed job."""
+        if self.future.done() and not self.future.cancelled():
+            return self.future.exception()
+        return None
+
+
+class InterpretationQueue:
+    """Interprets raw data files in a pool of worker processes, so the run control does not wait for the interpretation.
+    Jobs are queued and processed in order of submission, at most max_workers jobs run at the same time.
+    """
+
+    def __init__(self, max_workers: int = 1) -> None:
+        """
+        Args:
+            max_workers (int, optional): Maximum number of concurrent interpretation jobs. Defaults to 1.
+        """
+        if max_workers < 1:
+            raise ValueError("At least one worker process is needed")
+        self.log = logger.setup_derived_logger(__class__.__name__)
+        self.max_workers = max_workers
+        self.jobs = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        filepath_in: str | Path,
+        filepath_out: str | Path,
+        callback: Callable[[InterpretationJob], None] | None = None,
+        **kwargs,
+    ) -> int:
+        """Queues the interpretation of a raw data file.
+
+        Args:
+            filepath_in (str | Path): raw data file path as string or Path object
+            filepath_out (str | Path): output path of the interpreted data as string or Path object
+            callback (Callable[[InterpretationJob], None] | None, optional): Called with the job when it is finished.
+                Defaults to None.
+            **kwargs: Further arguments of interpret_data.
+
+        Returns:
+            int: Job ID.
+        """
+        with self._lock:
+            if self._executor is None:
+                # Worker processes are spawned, forking the multi-threaded run control is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            job_id = len(self.jobs)
+            future = self._executor.submit(
+                interpret_data, filepath_in, filepath_out, **kwargs
+            )
+            job = InterpretationJob(job_id, filepath_in, filepath_out, future)
+            self.jobs[job_id] = job
+        self.log.info('Queued interpretation of "%s"' % filepath_in)
+        future.add_done_callback(lambda _: self._finished(job, callback))
+        return job_id
+
+    def status(self, job_id: int) -> str:
+        """Status of a job.
+
+        Args:
+            job_id (int): Job ID.
+
+        Returns:
+            str: 'pending', 'running', 'cancelled', 'failed' or 'done'.
+        """
+        return self.jobs[job_id].status
+
+    @property
+    def n_pending(self) -> int:
+        """Number of queued or running jobs."""
+        return sum(not job.future.done() for job in list(self.jobs.values()))
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Waits for all submitted jobs.
+
+        Args:
+            timeout (float | None, optional): Maximum waiting time in seconds. Defaults to None.
+
+        Returns:
+            bool: True if all jobs are finished.
+        """
+        futures = [job.future for job in list(self.jobs.values())]
+        _, not_done = concurrent.futures.wait(futures, timeout=timeout)
+        return not not_done
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stops the worker processes.
+
+        Args:
+            wait (bool, optional): Finish all queued jobs, otherwise queued jobs are cancelled. Defaults to True.
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=not wait)
+                self._executor = None
+
+    def _finished(
+        self,
+        job: InterpretationJob,
+        callback: Callable[[InterpretationJob], None] | None,
+    ) -> None:
+        """Logs the result of a job and calls its callback."""
+        if job.status == "failed":
+            self.log.error(
+                'Interpretation of "%s" failed: %s' % (job.filepath_in, job.error)
+            )
+        elif job.status == "done":
+            self.log.success('Interpreted "%s"' % job.filepath_out)
+        elif job.status == "cancelled":
+            self.log.warning('Interpretation of "%s" cancelled' % job.filepath_in)
+        if callback is not None:
+            try:
+                callback(job)
+            except Exception as e:
+                self.log.error("Interpretation callback failed: %s" % e)
@@ -0,0 +1,478 @@
+import threading
+import time
+from typing import Any, Callable
+
+import numpy as np
+
+from aidatlu import logger
+
+
+class PollScheduler:
+    """Adapts the FIFO poll interval to the FIFO fill level.
+    The interval is shortened as soon as the fill level rises towards the watermark and
+    reaches the minimum interval at the watermark. While the FIFO stays empty the interval
+    is doubled after each poll up to the maximum interval.
+    """
+
+    def __init__(
+        self,
+        min_interval: float = 0.0,
+        max_interval: float = 0.01,
+        watermark: int = 8000,
+        fifo_size: int = 32000,
+        n_bins: int = 16,
+    ) -> None:
+        """
+        Args:
+            min_interval (float, optional): Minimum poll interval in seconds. Defaults to 0.0.
+            max_interval (float, optional): Maximum poll interval in seconds. Defaults to 0.01.
+            watermark (int, optional): Fill level in words, above which the FIFO is polled with the minimum interval.
+                Defaults to 8000.
+            fifo_size (int, optional): Size of the FIFO in words. Defaults to 32000.
+            n_bins (int, optional): Number of bins of the fill level histogram. Defaults to 16.
+        """
+        if not 0 <= min_interval <= max_interval:
+            raise ValueError(
+                "Poll intervals must fulfill 0 <= min_interval <= max_interval"
+            )
+        if watermark <= 0:
+            raise ValueError("Watermark must be positive")
+        self.log = logger.setup_derived_logger(__class__.__name__)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.watermark = watermark
+        self.fifo_size = fifo_size
+        # Smallest interval used when backing off from the minimum interval 0
+        self.backoff_start = min(1e-4, max_interval)
+        self.histogram = np.zeros(n_bins, dtype=np.int64)
+        self.reset()
+
+    def reset(self) -> None:
+        """Resets the interval and the statistics, e.g. at the start of a run."""
+        self.interval = self.min_interval
+        self.histogram[:] = 0
+        self.n_polls = 0
+        self._interval_sum = 0.0
+
+    def update(self, fill_level: int) -> float:
+        """Chooses the interval until the next poll.
+
+        Args:
+            fill_level (int): FIFO fill level in words after the last poll.
+
+        Returns:
+            float: Poll interval in seconds.
+        """
+        fill_level = max(fill_level, 0)
+        if fill_level == 0:
+            self.interval = min(
+                max(2 * self.interval, self.backoff_start), self.max_interval
+            )
+        else:
+            target = self.max_interval * max(1 - fill_level / self.watermark, 0)
+            self.interval = max(min(self.interval, target), self.min_interval)
+
+        n_bins = self.histogram.size
+        self.histogram[min(fill_level * n_bins // self.fifo_size, n_bins - 1)] += 1
+        self.n_polls += 1
+        self._interval_sum += self.interval
+        return self.interval
+
+    def get_report(self) -> dict:
+        """Poll statistics.
+
+        Returns:
+            dict: Current and mean poll interval in seconds, number of polls, fill level histogram and its bin edges in words.
+        """
+        return {
+            "interval": self.interval,
+            "mean_interval": self._interval_sum / self.n_polls if self.n_polls else 0.0,
+            "polls": self.n_polls,
+            "histogram": self.histogram.tolist(),
+            "bin_edges": np.linspace(0, self.fifo_size, self.histogram.size + 1)
+            .astype(int)
+            .tolist(),
+        }
+
+    def log_report(self) -> None:
+        """Logs the poll statistics."""
+        report = self.get_report()
+        self.log.debug(
+            "Poll interval: %.2e s (mean %.2e s) after %i polls, fill level histogram: %s"
+            % (
+                report["interval"],
+                report["mean_interval"],
+                report["polls"],
+                report["histogram"],
+            )
+        )
+
+
+class EventFramer:
+    """Frames the FIFO word stream into events of six words.
+    Words of an incomplete event are kept and prepended to the words of the next poll.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        """Discards the words of an incomplete event, e.g. at the start of a run."""
+        self._remainder = np.empty(0, dtype=np.uint32)
+
+    @property
+    def n_remainder(self) -> int:
+        """Number of words waiting for the rest of their event."""
+        return self._remainder.size
+
+    def frame(self, words: np.ndarray) -> np.ndarray:
+        """Frames FIFO words into complete events.
+
+        Args:
+            words (np.ndarray): FIFO words of a poll.
+
+        Returns:
+            np.ndarray: uint32 array of shape (N, 6) with the complete events.
+        """
+        words = np.asarray(words, dtype=np.uint32).ravel()
+        if self._remainder.size:
+            words = np.concatenate((self._remainder, words))
+        n_words = words.size - words.size % 6
+        self._remainder = words[n_words:].copy()
+        return words[:n_words].reshape(-1, 6)
+
+
+def event_timestamps(events: np.ndarray) -> np.ndarray:
+    """Timestamps of framed events in nanoseconds, calculated from the TLU 40MHz clock.
+
+    Args:
+        events (np.ndarray): Events of shape (N, 6).
+
+    Returns:
+        np.ndarray: uint64 array of the timestamps.
+    """
+    return 25 * (
+        ((events[:, 0].astype(np.uint64) & 0x0000FFFF) << np.uint64(32))
+        + events[:, 1].astype(np.uint64)
+    )
+
+
+def trigger_numbers(events: np.ndarray) -> np.ndarray:
+    """Trigger numbers of framed events.
+
+    Args:
+        events (np.ndarray): Events of shape (N, 6).
+
+    Returns:
+        np.ndarray: uint32 array of the trigger numbers.
+    """
+    return events[:, 3]
+
+
+def batch_metadata(events: np.ndarray) -> dict:
+    """Metadata of a batch of events sent in one data record.
+    Timestamps are in picoseconds, the end of the batch is one clock cycle after the last event.
+    For batches of more than one event the trigger number and timestamp of each event are added
+    as lists in the order of the blocks.
+
+    Args:
+        events (np.ndarray): Events of shape (N, 6).
+
+    Returns:
+        dict: Trigger number of the first event and timestamp range of the batch, number of events and
+            per event trigger numbers and timestamps for batches of more than one event.
+    """
+    timestamps = event_timestamps(events) * 1000
+    numbers = trigger_numbers(events)
+    meta = {
+        "flag_trigger": True,
+        "trigger_number": int(numbers[0]),
+        "timestamp_begin": int(timestamps[0]),
+        "timestamp_end": int(timestamps[-1]) + 25000,
+    }
+    if events.shape[0] > 1:
+        meta["n_events"] = events.shape[0]
+        meta["trigger_numbers"] = numbers.tolist()
+        meta["timestamps"] = timestamps.tolist()
+    return meta
+
+
+def event_blocks(events: np.ndarray) -> list:
+    """Serializes events into one block per event, six little-endian uint32 words each.
+
+    Args:
+        events (np.ndarray): Events of shape (N, 6).
+
+    Returns:
+        list: 24 bytes per event.
+    """
+    payload = np.ascontiguousarray(events, dtype="<u4").tobytes()
+    return [payload[24 * index : 24 * (index + 1)] for index in range(events.shape[0])]
+
+
+class EventBatcher:
+    """Collects framed events into batches of batch_size events, each batch is passed to the send callback.
+    Events of an incomplete batch are kept until the batch is complete or the batch timeout has passed.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[np.ndarray], None],
+        batch_size: int = 1,
+        batch_timeout: float = 0.1,
+    ) -> None:
+        """
+        Args:
+            send (Callable[[np.ndarray], None]): Sends a batch of events of shape (N, 6).
+            batch_size (int, optional): Number of events per batch. Defaults to 1.
+            batch_timeout (float, optional): Maximum time in seconds events wait for their batch to be complete. Defaults to 0.1.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.send = send
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.n_batches = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """Discards the events of an incomplete batch, e.g. at the start of a run."""
+        self._pending = np.empty((0, 6), dtype=np.uint32)
+        self._pending_since = time.monotonic()
+
+    @property
+    def n_pending(self) -> int:
+        """Number of events waiting for their batch to be complete."""
+        return self._pending.shape[0]
+
+    def add(self, events: np.ndarray) -> None:
+        """Adds framed events and sends all complete batches.
+
+        Args:
+            events (np.ndarray): Events of shape (N, 6).
+        """
+        if not events.size:
+            return
+        if not self._pending.size:
+            self._pending_since = time.monotonic()
+            self._pending = events
+        else:
+            self._pending = np.concatenate((self._pending, events))
+        n_events = self._pending.shape[0]
+        n_batched = n_events - n_events % self.batch_size
+        for start in range(0, n_batched, self.batch_size):
+            self._send(self._pending[start : start + self.batch_size])
+        if n_batched:
+            self._pending = self._pending[n_batched:]
+            self._pending_since = time.monotonic()
+
+    def flush(self, force: bool = False) -> None:
+        """Sends the events of an incomplete batch once the batch timeout has passed.
+
+        Args:
+            force (bool, optional): Send the events independent of the timeout, e.g. at the end of a run. Defaults to False.
+        """
+        if self._pending.size and (
+            force or time.monotonic() - self._pending_since >= self.batch_timeout
+        ):
+            self._send(self._pending)
+            self._pending = self._pending[:0]
+
+    def _send(self, events: np.ndarray) -> None:
+        self.send(events)
+        self.n_batches += 1
+
+
+class StatusSampler:
+    """Caches a sample of the TLU counters for metrics and status calculations.
+    The sample is refreshed in a single batched read, either by the status loop or when a
+    cached sample is older than the staleness bound. Access is thread safe.
+    """
+
+    def __init__(self, read_status: Callable[[], Any], max_age: float = 1.0) -> None:
+        """
+        Args:
+            read_status (Callable[[], Any]): Reads a new sample, e.g. TLUControl.get_status.
+            max_age (float, optional): Maximum age of a cached sample in seconds. Defaults to 1.0.
+        """
+        if max_age < 0:
+            raise ValueError("Maximum sample age must not be negative")
+        self.read_status = read_status
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._status = None
+        self._sample_time = 0.0
+        self.n_samples = 0
+
+    @property
+    def age(self) -> float:
+        """Age of the cached sample in seconds, infinite if there is none."""
+        if self._status is None:
+            return float("inf")
+        return time.monotonic() - self._sample_time
+
+    def sample(self) -> Any:
+        """Reads a new sample and caches it.
+
+        Returns:
+            Any: New sample.
+        """
+        with self._lock:
+            return self._sample()
+
+    def get(self) -> Any:
+        """Cached sample, a new sample is read if the cached one is older than the staleness bound.
+
+        Returns:
+            Any: Sample not older than max_age.
+        """
+        with self._lock:
+            if self.age > self.max_age:
+                return self._sample()
+            return self._status
+
+    def invalidate(self) -> None:
+        """Discards the cached sample, e.g. after the counters are reset."""
+        with self._lock:
+            self._status = None
+
+    def _sample(self) -> Any:
+        self._status = self.read_status()
+        self._sample_time = time.monotonic()
+        self.n_samples += 1
+        return self._status
+
+
+class ResyncFramer:
+    """Frames a possibly corrupted raw word stream into events and resynchronizes it after glitches.
+    A valid event starts at word i if its sixth word i + 5 is zero. Consecutive events are linked if
+    both are valid and the event number (fourth word) of the second one is incremented by one. Chains of linked
+    events are accepted at once, only at the end of a chain the next valid link is searched.
+    The words in between are quarantined and reported as segments of absolute word positions.
+    A segment reaching the end of the words may continue in the next words, it is reported with the next call.
+    """
+
+    def __init__(
+        self,
+        offset: int = 0,
+        linked: bool = False,
+        open_segment: tuple | None = None,
+    ) -> None:
+        """
+        Args:
+            offset (int, optional): Position of the first word in the stream. Defaults to 0.
+            linked (bool, optional): The first event is linked to an already accepted event. Defaults to False.
+            open_segment (tuple | None, optional): Quarantined segment (start, stop) ending at offset,
+                which is not reported yet. Defaults to None.
+        """
+        self.offset = offset
+        self.linked = linked
+        self.open_segment = open_segment
+        self.n_quarantined_words = 0
+        self.n_quarantined_segments = 0
+        self._remainder = np.empty(0, dtype=np.uint32)
+
+    @property
+    def n_remainder(self) -> int:
+        """Number of words waiting for the next words of the stream."""
+        return self._remainder.size
+
+    def frame(self, words: np.ndarray, final: bool = False) -> tuple:
+        """Frames the next words of the stream into events.
+
+        Args:
+            words (np.ndarray): Raw words.
+            final (bool, optional): The words are the end of the stream, no words are kept. Defaults to False.
+
+        Returns:
+            tuple: uint32 array of shape (N, 6) with the accepted events and array of the quarantined
+                segments with the fields 'start' and 'stop'.
+        """
+        words = np.asarray(words, dtype=np.uint32).ravel()
+        if self._remainder.size:
+            words = np.concatenate((self._remainder, words))
+        n_words = words.size
+        valid = np.zeros(n_words, dtype=bool)
+        valid[: max(n_words - 5, 0)] = words[5:] == 0
+        # Events whose link to the next event can be checked
+        n_linkable = max(n_words - 11, 0)
+        link = (
+            valid[:n_linkable]
+            & valid[6 : 6 + n_linkable]
+            # Consecutive event numbers, the uint32 difference also holds at the wrap around
+            & (words[9 : 9 + n_linkable] - words[3 : 3 + n_linkable] == 1)
+        )
+
+        # Positions of all links and of the missing links per word position modulo six,
+        # chains and resynchronization points are looked up instead of searched per glitch
+        links = np.flatnonzero(link)
+        breaks = [6 * np.flatnonzero(~link[offset::6]) + offset for offset in range(6)]
+
+        accepted = []
+        segments = []
+        pos = 0
+        head_linked = self.linked
+        carry = n_words
+        while pos < n_words:
+            # Follow the chain of linked events starting at pos
+            chain_breaks = breaks[pos % 6]
+            index = np.searchsorted(chain_breaks, pos)
+            if index < chain_breaks.size:
+                n_chain = (chain_breaks[index] - pos) // 6
+            else:
+                n_chain = (max(n_linkable - pos, 0) + 5) // 6
+            end = pos + 6 * n_chain
+            tail_linked = n_chain > 0 or head_linked
+            if end >= n_linkable and not final:
+                # The link of the last event is checked with the next words
+                accepted.append((pos, end))
+                carry, self.linked = end, tail_linked
+                break
+            if tail_linked and end + 6 <= n_words and valid[end]:
+                # Last event of the chain, linked to the previous one
+                end += 6
+            accepted.append((pos, end))
+
+            # Search the next chain, the words in between are quarantined
+            search_start = end if end > pos else pos + 1
+            index = np.searchsorted(links, search_start)
+            resync = index < links.size
+            if resync:
+                pos = links[index]
+            elif final:
+                pos = n_words
+            else:
+                # The next chain may start in the words, whose links are not known yet
+                pos = max(search_start, n_linkable)
+            if pos > end:
+                segments.append((end, pos))
+            if not resync:
+                carry, self.linked = pos, False
+                break
+            head_linked = False
+
+        events = np.concatenate(
+            [words[start:stop] for start, stop in accepted if stop > start]
+            or [np.empty(0, dtype=np.uint32)]
+        ).reshape(-1, 6)
+        segments = [
+            (int(self.offset + start), int(self.offset + stop))
+            for start, stop in segments
+        ]
+        if self.open_segment is not None:
+            # Merge the segment of the previous words, if the corrupted words continue
+            if segments and segments[0][0] == self.open_segment[1]:
+                segments[0] = (self.open_segment[0], segments[0][1])
+            else:
+                segments.insert(0, self.open_segment)
+            self.open_segment = None
+        self._remainder = words[carry:].copy()
+        self.offset += carry
+        if final:
+            self.linked = False
+        elif segments and segments[-1][1] == self.offset:
+            self.open_segment = segments.pop()
+        quarantine = np.array(segments, dtype=[("start", "u8"), ("stop", "u8")])
+        self.n_quarantined_segments += len(segments)
+        self.n_quarantined_words += sum(stop - start for start, stop in segments)
+        return events, quarantine
@@ -1,5 +1,4 @@
 import threading
-import time
 from datetime import datetime
 from pathlib import Path
 
@@ -8,22 +7,51 @@ import tables as tb
 import zmq
 
 from aidatlu import logger
-from aidatlu.hardware.tlu_controller import TLUControl, TLUConfigure
+from aidatlu.hardware.tlu_controller import TLUControl, TLUConfigure, TLUStatus
 from aidatlu.hardware.i2c import I2CCore
 from aidatlu.main.config_parser import yaml_parser
-from aidatlu.main.data_parser import interpret_data
+from aidatlu.main.data_parser import StreamInterpreter, interpret_data
+from aidatlu.main.data_writer import DataWriter
+from aidatlu.main.interpretation_queue import InterpretationQueue
+from aidatlu.main.readout import PollScheduler
 
 
 class AidaTLU:
-    def __init__(self, hw, config_dict, clock_config_path, i2c=I2CCore) -> None:
+    def __init__(
+        self,
+        hw,
+        config_dict,
+        clock_config_path,
+        i2c=I2CCore,
+        shadow_cache=False,
+        warm_start=False,
+        online_interpretation=False,
+        interpretation_workers=0,
+    ) -> None:
         self.log = logger.setup_derived_logger(__class__.__name__)
 
-        self.tlu_controller = TLUControl(hw=hw, i2c=i2c)
-        self.tlu_controller.write_clock_config(clock_config_path)
+        self.tlu_controller = TLUControl(hw=hw, i2c=i2c, shadow_cache=shadow_cache)
+        self.tlu_controller.write_clock_config(clock_config_path, warm_start=warm_start)
 
         self.reset_configuration()
         self.tlu_configure = TLUConfigure(self.tlu_controller, config_dict)
 
+        # Run control, the run stops when stop_event is set
+        self.stop_event = threading.Event()
+        self._status_stop = threading.Event()
+        self._status_thread = None
+        # Adapts the FIFO poll interval to the fill level
+        self.poll_scheduler = PollScheduler()
+        # Interpret the data during the run instead of after the run
+        self.online_interpretation = online_interpretation
+        self.stream_interpreter = None
+        # Interpret the data after the run in worker processes, the next run can start immediately
+        self.interpretation_queue = (
+            InterpretationQueue(max_workers=interpretation_workers)
+            if interpretation_workers > 0
+            else None
+        )
+
         self.log.success("TLU initialized")
 
     def configure(self) -> None:
@@ -70,46 +98,47 @@ class AidaTLU:
         )
         self.buffer = []
         config_table.append(self.conf_list)
+        if self.online_interpretation:
+            self.stream_interpreter = StreamInterpreter(self.interpreted_data_path)
+        self.data_writer = DataWriter(
+            self.data_table, interpreter=self.stream_interpreter
+        )
 
     def handle_status(self) -> None:
         """Status message handling in separate thread. Calculates run time and obtain trigger information and sent it out every second."""
-        t = threading.current_thread()
-        while getattr(t, "do_run", True):
-            time.sleep(0.5)
-            last_time = self.tlu_controller.get_timestamp()
-            current_time = (last_time - self.start_time) * 25 / 1000000000
+        while not self._status_stop.wait(0.5):
+            status = self.tlu_controller.get_status()
+            current_time = (status.timestamp - self.start_time) * 25 / 1000000000
             # Logs and poss. sends status every 1s.
             if current_time - self.last_time > 1:
-                self.log_sent_status(current_time)
+                self.log_sent_status(current_time, status)
             # Stops the TLU after some time in seconds.
             if self.timeout != None:
                 if current_time > self.timeout:
-                    self.stop_condition = True
+                    self.request_stop()
             if self.max_trigger != None:
-                if (
-                    self.tlu_controller.trigger_logic.get_post_veto_trigger()
-                    > self.max_trigger
-                ):
-                    self.stop_condition = True
+                if status.post_veto_triggers > self.max_trigger:
+                    self.request_stop()
 
-    def log_sent_status(self, time: int) -> None:
+    def log_sent_status(self, time: int, status: TLUStatus | None = None) -> None:
         """Logs the status of the TLU run with runtime, pre- and post-veto numbers/rates.
            Also calculates the mean trigger frequency between function calls.
 
         Args:
             time (int): current runtime of the TLU
+            status (TLUStatus | None, optional): Sample of the TLU counters, read from the TLU if None. Defaults to None.
         """
+        if status is None:
+            status = self.tlu_controller.get_status()
         self.post_veto_rate = (
-            self.tlu_controller.trigger_logic.get_post_veto_trigger()
-            - self.last_post_veto_trigger
-        ) / (time - self.last_time)
-        self.pre_veto_rate = (
-            self.tlu_controller.trigger_logic.get_pre_veto_trigger()
-            - self.last_pre_veto_trigger
+            status.post_veto_triggers - self.last_post_veto_trigger
         ) / (time - self.last_time)
+        self.pre_veto_rate = (status.pre_veto_triggers - self.last_pre_veto_trigger) / (
+            time - self.last_time
+        )
         self.run_time = time
-        self.total_post_veto = self.tlu_controller.trigger_logic.get_post_veto_trigger()
-        self.total_pre_veto = self.tlu_controller.trigger_logic.get_pre_veto_trigger()
+        self.total_post_veto = status.post_veto_triggers
+        self.total_pre_veto = status.pre_veto_triggers
 
         if self.zmq_address:
             self.socket.send_string(
@@ -126,12 +155,8 @@ class AidaTLU:
             )
 
         self.last_time = time
-        self.last_post_veto_trigger = (
-            self.tlu_controller.trigger_logic.get_post_veto_trigger()
-        )
-        self.last_pre_veto_trigger = (
-            self.tlu_controller.trigger_logic.get_pre_veto_trigger()
-        )
+        self.last_post_veto_trigger = status.post_veto_triggers
+        self.last_pre_veto_trigger = status.pre_veto_triggers
 
         self.log.info(
             "Run time: %.1f s, Pre veto: %s, Post veto: %s, Pre veto rate: %.f Hz, Post veto rate.: %.f Hz"
@@ -144,9 +169,13 @@ class AidaTLU:
             )
         )
 
-        if self.tlu_controller.get_event_fifo_csr() == 0x10:
+        if status.fifo_csr == 0x10:
             self.log.warning("FIFO is full")
 
+        if self.save_data:
+            self.log.debug("Data queue: %s" % self.data_writer.get_statistics())
+        self.poll_scheduler.log_report()
+
     def log_trigger_inputs(self, event_vector: list) -> None:
         """Logs which inputs triggered the event corresponding to the event vector.
 
@@ -173,26 +202,30 @@ class AidaTLU:
         self.log.info("Connected ZMQ socket with address: %s" % self.zmq_address)
 
     def run(self) -> None:
-        """Start run of the TLU."""
+        """Start run of the TLU. The FIFO is read in a separate readout thread and the data written
+        by the data writer thread. The run stops on the configured stop conditions or with Ctrl+C.
+        """
         self.start_run_configuration()
-        self.run_active = True
-        t = threading.Thread(target=self.handle_status)
-        t.start()
-        while self.run_active:
+        self._status_thread = threading.Thread(target=self.handle_status, name="Status")
+        self._status_thread.start()
+        readout = threading.Thread(target=self.readout_loop, name="Readout")
+        readout.start()
+        try:
+            while readout.is_alive():
+                readout.join(timeout=0.5)
+        except KeyboardInterrupt:
+            self.log.info("Run stopped by user")
+            self.request_stop()
+            readout.join()
+        finally:
             try:
-                self.run_loop()
-                if self.stop_condition is True:
-                    raise KeyboardInterrupt
-            except:
-                if KeyboardInterrupt:
-                    self.run_active = False
-                else:
-                    # If this happens: poss. Hitrate to high for FIFO and or data handling.
-                    self.log.warning("Incomplete event handling...")
-
-        self.stop_run()
-        t.do_run = False
-        self.stop_run_configuration()
+                self.stop_run()
+            finally:
+                self.stop_run_configuration()
+
+    def request_stop(self) -> None:
+        """Stops a running TLU run. Can be called from any thread."""
+        self.stop_event.set()
 
     def start_run_configuration(self) -> None:
         """Start of the run configurations, consists of timestamp resets, data preparations and zmq connections initialization."""
@@ -208,7 +241,9 @@ class AidaTLU:
         self.last_pre_veto_trigger = (
             self.tlu_controller.trigger_logic.get_pre_veto_trigger()
         )
-        self.stop_condition = False
+        self.stop_event.clear()
+        self._status_stop.clear()
+        self.poll_scheduler.reset()
         # prepare data handling and zmq connection
         self.save_data = self.tlu_configure.get_data_handling()
         self.zmq_address = self.tlu_configure.get_zmq_connection()
@@ -229,47 +264,103 @@ class AidaTLU:
                 datetime.now().strftime("%Y_%m_%d_%H_%M_%S"),
             )
             self.init_raw_data_table()
+            self.data_writer.start()
 
         if self.zmq_address:
             self.setup_zmq()
 
-    def run_loop(self) -> None:
-        """A single instance of the run loop. In a TLU run this function needs to be called repeatedly.
-
-        Raises:
-            KeyboardInterrupt: The run loop can be interrupted when raising a KeyboardInterrupt.
+    def readout_loop(self) -> None:
+        """Reads the FIFO until the run is stopped. Runs in the readout thread during a TLU run.
+        Between polls the loop waits for the interval chosen by the poll scheduler or until the run is stopped.
         """
         try:
-            current_event = self.tlu_controller.pull_fifo_event()
-            try:
-                if self.save_data and np.size(current_event) > 1:
-                    self.data_table.append(current_event)
-                if self.stop_condition is True:
-                    raise KeyboardInterrupt
-            except:
-                if KeyboardInterrupt:
-                    self.run_active = False
-                else:
-                    # If this happens: poss. Hitrate to high for FIFO and or Data handling.
-                    self.log.warning("Incomplete Event handling...")
+            while not self.stop_event.is_set():
+                self.run_loop()
+                interval = self.poll_scheduler.update(
+                    self.tlu_controller.fifo_fill_level
+                )
+                if interval:
+                    self.stop_event.wait(interval)
+        except Exception as e:
+            self.log.error("Readout failed, stopping run: %s" % e)
+            self.request_stop()
+
+    def run_loop(self) -> bool:
+        """A single instance of the run loop. In a TLU run this function needs to be called repeatedly.
 
-        except KeyboardInterrupt:
-            self.run_active = False
+        Returns:
+            bool: True if data was read from the FIFO.
+        """
+        current_event = self.tlu_controller.pull_fifo_event()
+        if np.size(current_event) > 1:
+            if self.save_data:
+                self.data_writer.put(current_event)
+            return True
+        return False
 
     def stop_run_configuration(self) -> None:
-        """Cleans remaining FIFO data and closes data files and zmq connections after a run."""
-        # Cleanup of FIFO
-        self.tlu_controller.pull_fifo_event()
-
-        if self.zmq_address:
-            self.socket.close()
+        """Cleans remaining FIFO data and closes data files and zmq connections after a run.
+        The FIFO is drained first, then the data writer is flushed and the status thread stopped.
+        The threads are stopped and the files closed even if draining the FIFO fails.
+        """
+        try:
+            # Cleanup of FIFO. Each read also updates the fill level for the next one,
+            # the FIFO is empty after two consecutive reads without data.
+            n_empty = 0
+            while n_empty < 2:
+                n_empty = 0 if self.run_loop() else n_empty + 1
+        finally:
+            self._close_run()
 
         if self.save_data:
-            self.h5_file.close()
-            interpret_data(self.raw_data_path, self.interpreted_data_path)
+            if self.stream_interpreter is not None:
+                if self.data_writer.interpreter is None:
+                    # Online interpretation failed during the run
+                    interpret_data(self.raw_data_path, self.interpreted_data_path)
+                self.stream_interpreter = None
+            elif self.interpretation_queue is not None:
+                self.interpretation_queue.submit(
+                    self.raw_data_path, self.interpreted_data_path
+                )
+            else:
+                interpret_data(self.raw_data_path, self.interpreted_data_path)
 
         self.log.info("Run finished")
 
+    def close(self, wait: bool = True) -> None:
+        """Stops the interpretation worker processes. Call this when the TLU is not used anymore.
+
+        Args:
+            wait (bool, optional): Finish the queued interpretations, otherwise they are cancelled. Defaults to True.
+        """
+        if self.interpretation_queue is not None:
+            if wait and self.interpretation_queue.n_pending:
+                self.log.info(
+                    "Waiting for %s interpretation jobs"
+                    % self.interpretation_queue.n_pending
+                )
+            self.interpretation_queue.shutdown(wait=wait)
+
+    def _close_run(self) -> None:
+        """Stops the data writer and the status thread and closes the raw data file and the zmq connection."""
+        try:
+            if self.save_data:
+                # Write all queued data before closing the file
+                self.data_writer.stop()
+        finally:
+            self._status_stop.set()
+            if self._status_thread is not None:
+                self._status_thread.join()
+                self._status_thread = None
+
+            if self.zmq_address:
+                self.socket.close()
+
+            if self.save_data:
+                self.h5_file.close()
+                if self.stream_interpreter is not None:
+                    self.stream_interpreter.close(self.conf_list)
+
 
 if __name__ == "__main__":
     import uhal
@@ -49,6 +49,8 @@ def test_config_parser():
     assert CONFIG_FILE["output_data_path"] == tlu_configure.get_output_data_path()
     assert (None, CONFIG_FILE["timeout"]) == tlu_configure.get_stop_condition()
     assert CONFIG_FILE["zmq_connection"] == tlu_configure.get_zmq_connection()
+    assert CONFIG_FILE["online_interpretation"] is False
+    assert CONFIG_FILE["interpretation_workers"] == 0
 
     config_toml_path = FILEPATH / "fixtures" / "tlu_test_configuration.toml"
     assert toml_parser(config_toml_path) == yaml_parser(CONFIG_FILE_PATH)
@@ -1,8 +1,17 @@
 from pathlib import Path
+import time
 import numpy as np
 import tables as tb
 import pytest
-from aidatlu.main.data_parser import interpret_data
+from aidatlu.main.data_parser import (
+    EventDecoder,
+    StreamInterpreter,
+    _decode_kernel,
+    interpret_data,
+)
+from aidatlu.main.data_query import InterpretedData
+from aidatlu.main.data_writer import DataWriter
+from aidatlu.main.interpretation_queue import InterpretationQueue
 
 FILEPATH = Path(__file__).parent
 
@@ -29,5 +38,309 @@ def test_interpreted_data():
     assert np.array_equal(config_table, config_table_test)
 
 
+def test_interpreted_data_parallel(tmp_path):
+    """Test interpreting chunks of the data in parallel processes"""
+
+    interpret_data(
+        FILEPATH / "fixtures" / "raw_data_test.h5",
+        tmp_path / "interpreted_data.h5",
+        chunk_size=200000,
+        n_processes=2,
+    )
+
+    with tb.open_file(tmp_path / "interpreted_data.h5", "r") as file:
+        interpreted_data = file.root.interpreted_data[:]
+    with tb.open_file(FILEPATH / "fixtures" / "interpreted_data_test.h5", "r") as file:
+        assert np.array_equal(interpreted_data, file.root.interpreted_data[:])
+
+
+def test_interpreted_data_incremental(tmp_path):
+    """Test interpreting a growing raw data file incrementally"""
+
+    with tb.open_file(FILEPATH / "fixtures" / "raw_data_test.h5", "r") as file:
+        raw_data = file.root.raw_data[:]
+        config_table_test = file.root.conf[:]
+    with tb.open_file(FILEPATH / "fixtures" / "interpreted_data_test.h5", "r") as file:
+        interpreted_test_data = file.root.interpreted_data[:]
+
+    raw_path = tmp_path / "raw_data.h5"
+    interpreted_path = tmp_path / "interpreted_data.h5"
+    with tb.open_file(raw_path, "w") as file:
+        file.create_table(file.root, name="raw_data", obj=raw_data[:1000003])
+        file.create_table(file.root, name="conf", obj=config_table_test)
+    interpret_data(raw_path, interpreted_path, incremental=True)
+    with tb.open_file(interpreted_path, "r") as file:
+        assert file.root.interpreted_data.nrows == 166667
+        assert file.root.interpreted_data.attrs.consumed_raw_words == 1000002
+
+    with tb.open_file(raw_path, "a") as file:
+        file.root.raw_data.append(raw_data[1000003:])
+    interpret_data(raw_path, interpreted_path, chunk_size=300000, incremental=True)
+    # No new data
+    interpret_data(raw_path, interpreted_path, incremental=True)
+
+    with tb.open_file(interpreted_path, "r") as file:
+        assert np.array_equal(file.root.interpreted_data[:], interpreted_test_data)
+        assert np.array_equal(file.root.conf[:], config_table_test)
+
+
+def test_interpreted_data_resync(tmp_path):
+    """Test interpreting corrupted raw data with resynchronization"""
+
+    with tb.open_file(FILEPATH / "fixtures" / "raw_data_test.h5", "r") as file:
+        raw_data = file.root.raw_data[:]
+        config_table_test = file.root.conf[:]
+    with tb.open_file(FILEPATH / "fixtures" / "interpreted_data_test.h5", "r") as file:
+        interpreted_test_data = file.root.interpreted_data[:]
+
+    # Drop one word of event 1000
+    raw_path = tmp_path / "raw_data.h5"
+    with tb.open_file(raw_path, "w") as file:
+        file.create_table(file.root, name="raw_data", obj=np.delete(raw_data, 6002))
+        file.create_table(file.root, name="conf", obj=config_table_test)
+    interpret_data(
+        raw_path, tmp_path / "interpreted_data.h5", chunk_size=300000, resync=True
+    )
+
+    with tb.open_file(tmp_path / "interpreted_data.h5", "r") as file:
+        assert np.array_equal(
+            file.root.interpreted_data[:], np.delete(interpreted_test_data, 1000)
+        )
+        assert file.root.quarantine[:].tolist() == [(6000, 6005)]
+        assert file.root.interpreted_data.attrs.n_quarantined_words == 5
+
+    # Incremental interpretation, the corrupted words are split between the calls
+    corrupted = np.delete(raw_data, 6002)
+    interpreted_path = tmp_path / "interpreted_incremental.h5"
+    with tb.open_file(raw_path, "w") as file:
+        file.create_table(file.root, name="raw_data", obj=corrupted[:6012])
+        file.create_table(file.root, name="conf", obj=config_table_test)
+    interpret_data(raw_path, interpreted_path, resync=True, incremental=True)
+    with tb.open_file(raw_path, "a") as file:
+        file.root.raw_data.append(corrupted[6012:])
+    interpret_data(raw_path, interpreted_path, resync=True, incremental=True)
+
+    with tb.open_file(interpreted_path, "r") as file:
+        # The link of the last event is checked with the next words
+        assert np.array_equal(
+            file.root.interpreted_data[:],
+            np.delete(interpreted_test_data, 1000)[:-1],
+        )
+        assert file.root.quarantine[:].tolist() == [(6000, 6005)]
+        assert file.root.interpreted_data.attrs.n_quarantined_segments == 1
+
+
+def test_interpreted_data_query(tmp_path):
+    """Test querying events with the event number and timestamp indexes"""
+
+    with tb.open_file(FILEPATH / "fixtures" / "raw_data_test.h5", "r") as file:
+        raw_data = file.root.raw_data[:]
+        config_table_test = file.root.conf[:]
+    raw_path = tmp_path / "raw_data.h5"
+    interpreted_path = tmp_path / "interpreted_data.h5"
+    with tb.open_file(raw_path, "w") as file:
+        file.create_table(file.root, name="raw_data", obj=raw_data[:600000])
+        file.create_table(file.root, name="conf", obj=config_table_test)
+    interpret_data(raw_path, interpreted_path, incremental=True, create_index=True)
+    # The indexes are extended by the new events, also without create_index
+    with tb.open_file(raw_path, "a") as file:
+        file.root.raw_data.append(raw_data[600000:1200000])
+    interpret_data(raw_path, interpreted_path, incremental=True)
+    with tb.open_file(interpreted_path, "r") as file:
+        assert file.root.timestamp_index.nrows == 200000
+    with tb.open_file(raw_path, "a") as file:
+        file.root.raw_data.append(raw_data[1200000:])
+    interpret_data(raw_path, interpreted_path, incremental=True, create_index=True)
+
+    with tb.open_file(FILEPATH / "fixtures" / "interpreted_data_test.h5", "r") as file:
+        interpreted_test_data = file.root.interpreted_data[:]
+    timestamps = interpreted_test_data["timestamp"]
+    tmin, tmax = np.percentile(timestamps, [20, 21]).astype(int)
+
+    with InterpretedData(interpreted_path) as data:
+        assert data.indexed
+        assert data.data_table.cols.eventnumber.index.is_csi
+        assert data.get_event(1000) == interpreted_test_data[999]
+        with pytest.raises(KeyError):
+            data.get_event(2**32 - 1)
+        assert np.array_equal(
+            data.get_events(tmin, tmax),
+            interpreted_test_data[(timestamps >= tmin) & (timestamps < tmax)],
+        )
+
+    # Events beyond the timestamp index are scanned
+    with tb.open_file(interpreted_path, "a") as file:
+        assert file.root.timestamp_index.nrows == file.root.interpreted_data.nrows
+        file.root.timestamp_index.remove_rows(150000)
+    with InterpretedData(interpreted_path) as data:
+        assert np.array_equal(
+            data.get_events(tmin, tmax),
+            interpreted_test_data[(timestamps >= tmin) & (timestamps < tmax)],
+        )
+
+    # Without indexes the table is scanned
+    with InterpretedData(FILEPATH / "fixtures" / "interpreted_data_test.h5") as data:
+        assert not data.indexed
+        assert np.array_equal(
+            data.get_events(tmin, tmax),
+            interpreted_test_data[(timestamps >= tmin) & (timestamps < tmax)],
+        )
+
+
+def test_event_decoder():
+    """Test decoding events with the reused output buffer and the single pass kernel"""
+
+    rng = np.random.default_rng(0)
+    events = rng.integers(0, 2**32, size=(100, 6), dtype=np.uint32)
+    events[:, 5] = 0
+    w0 = events[:, 0].astype(np.uint64)
+
+    decoder = EventDecoder(use_numba=False)
+    data = decoder.decode(events).copy()
+    assert np.array_equal(data["eventnumber"], events[:, 3])
+    assert np.array_equal(data["timestamp"], events[:, 1])
+    assert np.array_equal(data["overflow"], w0 & 0xFFFF)
+    assert np.array_equal(data["eventtype"], (w0 >> 28) & 0xF)
+    for n in range(6):
+        assert np.array_equal(data["input%i" % (n + 1)], (w0 >> (16 + n)) & 0x1)
+    assert np.array_equal(data["sc1"], (events[:, 2] >> 24) & 0xFF)
+    assert np.array_equal(data["sc4"], events[:, 2] & 0xFF)
+    assert np.array_equal(data["sc5"], (events[:, 4] >> 24) & 0xFF)
+    assert np.array_equal(data["sc6"], (events[:, 4] >> 16) & 0xFF)
+    # The buffer is reused for smaller chunks
+    assert np.array_equal(decoder.decode(events[:10]), data[:10])
+
+    # Kernel compiled with numba, here run as Python function
+    decoder._allocate(100)
+    _decode_kernel(
+        events,
+        decoder._out["eventnumber"],
+        decoder._out["timestamp"],
+        decoder._out["overflow"],
+        decoder._out["eventtype"],
+        decoder._inputs,
+        decoder._scalers,
+    )
+    assert np.array_equal(decoder._out, data)
+
+
+def test_data_writer(tmp_path):
+    """Test writing raw data through the data writer queue"""
+
+    with tb.open_file(tmp_path / "raw_data.h5", "w") as file:
+        table = file.create_table(
+            file.root, name="raw_data", description=np.dtype([("raw", "u4")])
+        )
+        writer = DataWriter(table, max_queue_size=4)
+        writer.start()
+        for block in np.arange(60, dtype=np.uint32).reshape(10, 6):
+            assert writer.put(block)
+        writer.stop()
+        assert np.array_equal(table[:]["raw"], np.arange(60, dtype=np.uint32))
+        statistics = writer.get_statistics()
+        assert statistics["blocks"] == 10
+        assert statistics["dropped"] == 0
+        assert statistics["high_water_mark"] <= 4
+
+
+def test_data_writer_flush(tmp_path):
+    """Test flushing the data writer buffer by size and time"""
+
+    with tb.open_file(tmp_path / "raw_data.h5", "w") as file:
+        table = file.create_table(
+            file.root, name="raw_data", description=np.dtype([("raw", "u4")])
+        )
+        writer = DataWriter(table, buffer_size=24, flush_interval=0.1)
+        writer.start()
+        # Blocks not aligned to the six word events
+        for block in np.array_split(np.arange(64, dtype=np.uint32), 8):
+            writer.put(block)
+        time.sleep(0.5)
+        # Only complete events are flushed during the run
+        assert table.nrows == 60
+        writer.put(np.arange(64, 100, dtype=np.uint32))
+        writer.stop()
+        assert np.array_equal(table[:]["raw"], np.arange(100, dtype=np.uint32))
+        assert writer.get_statistics()["flushes"] > 2
+
+
+def test_data_writer_errors(tmp_path):
+    """Test that write errors and a stopped writer thread do not block the readout"""
+
+    with tb.open_file(tmp_path / "raw_data.h5", "w") as file:
+        table = file.create_table(
+            file.root, name="raw_data", description=np.dtype([("raw", "u4")])
+        )
+    # Appending to the table of the closed file fails
+    writer = DataWriter(table, max_queue_size=2, buffer_size=12, flush_interval=0.01)
+    writer.start()
+    for block in np.arange(60, dtype=np.uint32).reshape(10, 6):
+        writer.put(block)
+    time.sleep(0.1)
+    assert writer._thread.is_alive()
+    writer.stop()
+    assert writer.get_statistics()["dropped"] > 0
+
+    # The writer thread ended without reading the queue
+    writer = DataWriter(table, max_queue_size=2)
+    writer._run = lambda: None
+    writer.start()
+    writer._thread.join()
+    results = [writer.put(block) for block in np.zeros((4, 6), dtype=np.uint32)]
+    assert results == [False] * 4
+    writer.stop()
+
+
+def test_stream_interpreter(tmp_path):
+    """Test interpreting raw data during the run through the data writer"""
+
+    with tb.open_file(FILEPATH / "fixtures" / "raw_data_test.h5", "r") as file:
+        raw_data = file.root.raw_data[:]["raw"]
+        config_table_test = file.root.conf[:]
+    with tb.open_file(FILEPATH / "fixtures" / "interpreted_data_test.h5", "r") as file:
+        interpreted_test_data = file.root.interpreted_data[:]
+
+    interpreter = StreamInterpreter(tmp_path / "interpreted_data.h5")
+    with tb.open_file(tmp_path / "raw_data.h5", "w") as file:
+        table = file.create_table(
+            file.root, name="raw_data", description=np.dtype([("raw", "u4")])
+        )
+        writer = DataWriter(table, buffer_size=600, interpreter=interpreter)
+        writer.start()
+        # Blocks not aligned to the six word events
+        for block in np.array_split(raw_data, 37):
+            writer.put(block)
+        writer.stop()
+    interpreter.close(config_table_test)
+
+    with tb.open_file(tmp_path / "interpreted_data.h5", "r") as file:
+        assert np.array_equal(file.root.interpreted_data[:], interpreted_test_data)
+        assert np.array_equal(file.root.conf[:], config_table_test)
+
+
+def test_interpretation_queue(tmp_path):
+    """Test interpreting data in the background worker processes"""
+
+    finished = []
+    queue = InterpretationQueue(max_workers=2)
+    job_id = queue.submit(
+        FILEPATH / "fixtures" / "raw_data_test.h5",
+        tmp_path / "interpreted_data.h5",
+        callback=finished.append,
+    )
+    failed_id = queue.submit(tmp_path / "missing.h5", tmp_path / "missing_out.h5")
+    assert queue.wait(timeout=60)
+    queue.shutdown()
+    assert queue.status(job_id) == "done"
+    assert queue.status(failed_id) == "failed"
+    assert queue.n_pending == 0
+    assert [job.job_id for job in finished] == [job_id]
+
+    with tb.open_file(tmp_path / "interpreted_data.h5", "r") as file:
+        interpreted_data = file.root.interpreted_data[:]
+    with tb.open_file(FILEPATH / "fixtures" / "interpreted_data_test.h5", "r") as file:
+        assert np.array_equal(interpreted_data, file.root.interpreted_data[:])
+
+
 if __name__ == "__main__":
     pytest.main()
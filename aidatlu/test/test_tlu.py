@@ -1,13 +1,28 @@
 from pathlib import Path
 import time
 import os
+import sys
+import threading
 import pytest
+import numpy as np
 import aidatlu.logger as logger
 from aidatlu.main.tlu import AidaTLU
-from aidatlu.hardware.i2c import I2CCore
-from aidatlu.hardware.tlu_controller import TLUControl
-from aidatlu.test.utils import MockI2C
+from aidatlu.hardware.i2c import I2CCore, i2c_modules
+from aidatlu.hardware.tlu_controller import TLUControl, tlu_registers
+from aidatlu.hardware.register_map import connection_address_table, load_register_map
+from aidatlu.test.utils import FAKE_UHAL, FakeI2CHardware, MockI2C
 from aidatlu.main.config_parser import yaml_parser
+from aidatlu.main.readout import (
+    EventBatcher,
+    EventFramer,
+    PollScheduler,
+    ResyncFramer,
+    StatusSampler,
+    batch_metadata,
+    event_blocks,
+    event_timestamps,
+    trigger_numbers,
+)
 
 FILEPATH = Path(__file__).parent
 CONFIG_FILE_PATH = FILEPATH / "fixtures" / "tlu_test_configuration.yaml"
@@ -67,6 +82,385 @@ def test_check_ups():
         assert TLUCONTROL.get_event_fifo_fill_level() == 0
 
 
+def test_status():
+    """Test reading all TLU counters in one snapshot"""
+
+    status = TLUCONTROL.get_status()
+    with pytest.raises(AttributeError):
+        status.timestamp = 0
+    assert len(status.scalers) == 6
+    if MOCK:
+        assert status.timestamp == -0x100000001
+        assert status.scalers == (-1, -1, -1, -1, -1, -1)
+        assert status.fifo_fill_level == -1
+    else:
+        assert status.fifo_csr == TLUCONTROL.get_event_fifo_csr()
+
+
+def test_transaction(monkeypatch):
+    """Test batched register access in a single transaction"""
+
+    with TLUCONTROL.i2c.transaction():
+        TLUCONTROL.i2c.write_register("triggerLogic.TriggerVetoW", 1)
+        veto = TLUCONTROL.i2c.read_register_deferred("triggerLogic.TriggerVetoR")
+    assert veto.value() == 1
+    assert TLUCONTROL.trigger_logic.get_trigger_veto()
+
+    # The run control is sent in a single dispatch, read backs are logged afterwards
+    try:
+        import uhal  # noqa: F401
+    except ImportError:
+        monkeypatch.setitem(sys.modules, "uhal", FAKE_UHAL)
+    hw = FakeI2CHardware([0x21] + sorted(i2c_modules))
+    hw.registers["version"] = 0x1E000016
+    tlu = TLUControl(hw)
+    # Only the register accesses of the reset are counted, not the I2C transfers
+    monkeypatch.setattr(tlu.io_controller, "clock_lemo_output", lambda *_: None)
+    monkeypatch.setattr(tlu.io_controller, "configure_hdmi", lambda *_: None)
+    monkeypatch.setattr(tlu.io_controller, "all_off", lambda: None)
+    monkeypatch.setattr(tlu.dac_controller, "set_voltage", lambda *_: None)
+    monkeypatch.setattr(tlu.dac_controller, "set_threshold", lambda *_: None)
+    for run_control in [tlu.reset_configuration, tlu.start_run, tlu.stop_run]:
+        n_dispatches = hw.n_dispatches
+        run_control()
+        assert hw.n_dispatches - n_dispatches == 1
+    assert hw.registers["TriggerVetoW"] == 1
+    assert hw.registers["RunActiveRW"] == 0
+
+
+def test_shadow_cache():
+    """Test serving configuration registers from the shadow cache"""
+
+    TLUCONTROL.i2c.enable_shadow_cache()
+    TLUCONTROL.trigger_logic.set_pulse_delay_pack([0, 1, 0, 0, 3, 0])
+    if MOCK:
+        # Change the mock hardware behind the cache
+        TLUCONTROL.i2c._queue_write("triggerLogic.PulseDelayW", 0)
+    assert TLUCONTROL.trigger_logic.get_pulse_delay_pack() == 0x300020
+    # Counters are volatile and always read from the hardware
+    assert TLUCONTROL.i2c._shadow_key("triggerLogic.PostVetoTriggersR") is None
+    TLUCONTROL.i2c.disable_shadow_cache()
+
+
+def test_ioexpander_mirror():
+    """Test the local mirror of the IO expander outputs"""
+
+    io_controller = TLUCONTROL.io_controller
+    io_controller.all_off()
+    io_controller.switch_led(1, "g")
+    io_controller.configure_hdmi(2, 1)
+    io_controller.clock_hdmi_output(2, "chip")
+    for port, value in io_controller._outputs.items():
+        assert io_controller._get_ioexpander_output(*port) & 0xFF == value
+    io_controller.sync_outputs()
+    io_controller.all_off()
+
+
+def test_clock_bursts():
+    """Test grouping of the clock configuration into auto-increment bursts"""
+
+    rows = [
+        (0x0B24, 0xD8),
+        (0x0B25, 0x00),
+        (0x000B, 0x68),
+        (0x0016, 0x02),
+        (0x0017, 0x1C),
+        (0x00FF, 0x01),
+        (0x0100, 0x02),
+        (0x0B24, 0xDB),
+    ]
+    assert TLUCONTROL.clock_controller._compile_bursts(rows) == [
+        (0x0B24, [0xD8, 0x00]),
+        (0x000B, [0x68]),
+        (0x0016, [0x02, 0x1C]),
+        (0x00FF, [0x01]),
+        (0x0100, [0x02]),
+        (0x0B24, [0xDB]),
+    ]
+
+
+def test_clock_warm_start():
+    """Test skipping the clock configuration if the chip already holds it"""
+
+    clock_file = FILEPATH / "../misc/aida_tlu_clk_config.txt"
+    clock_controller = TLUCONTROL.clock_controller
+    TLUCONTROL.write_clock_config(clock_file, warm_start=True)
+    assert clock_controller.is_configured(clock_file)
+    if MOCK:
+        clock_controller.write_clock_register(0x0A03, 0x00)
+        assert not clock_controller.is_configured(clock_file)
+        TLUCONTROL.write_clock_config(clock_file, warm_start=True)
+        assert clock_controller.is_configured(clock_file)
+
+
+def test_i2c_scan(tmp_path):
+    """Test I2C bus scan with cached results"""
+
+    i2c = I2CMETHOD(HW)
+    cache_file = tmp_path / "i2c_scan.json"
+    found = i2c.scan(full_scan=True, cache_file=cache_file)
+    assert i2c.modules["eeprom"] == 0x50
+    assert cache_file.exists()
+    assert i2c.scan(full_scan=True, cache_file=cache_file) == found
+
+
+def test_i2c_pipeline(monkeypatch):
+    """Test pipelined I2C transfers against a model of the busy I2C master"""
+
+    try:
+        import uhal  # noqa: F401
+    except ImportError:
+        monkeypatch.setitem(sys.modules, "uhal", FAKE_UHAL)
+    # Without pipelining each command is written and polled separately
+    hw = FakeI2CHardware([0x21, 0x68])
+    i2c = I2CCore(hw)
+    i2c.set_i2c_clock_prescale(0x30)
+    i2c.set_i2c_control(0x80)
+    i2c.write_array(0x68, 0x10, [1, 2, 3, 4])
+    assert hw.devices[0x68] == {0x10: 1, 0x11: 2, 0x12: 3, 0x13: 4}
+    assert i2c.read(0x68, 0x12) == 3
+    assert hw.lost_commands == 0
+
+    hw = FakeI2CHardware([0x21, 0x68])
+    i2c = I2CCore(hw, pipeline=True)
+    i2c.set_i2c_clock_prescale(0x30)
+    i2c.set_i2c_control(0x80)
+    assert i2c.probe([0x10, 0x21, 0x68]) == [0x21, 0x68]
+
+    # The status samples derived from the prescale cover every command of a burst,
+    # writes are dispatched command by command
+    n_dispatches = hw.n_dispatches
+    i2c.write_array(0x68, 0x10, [1, 2, 3, 4])
+    assert hw.n_dispatches - n_dispatches == 6
+    i2c.write(0x21, 0x01, 0x7F)
+    assert hw.devices == {
+        0x21: {0x01: 0x7F},
+        0x68: {0x10: 1, 0x11: 2, 0x12: 3, 0x13: 4},
+    }
+    # Reads are sent in a single dispatch
+    n_dispatches = hw.n_dispatches
+    assert i2c.read(0x68, 0x12) == 3
+    assert hw.n_dispatches - n_dispatches == 1
+    assert hw.lost_commands == 0
+    assert i2c.pipeline_fallbacks == 0
+
+    # Too few samples: writes wait for the master before the next command, no command is lost
+    i2c.pipeline_poll_words = 64
+    i2c.write_array(0x68, 0x20, [5, 6, 7])
+    assert hw.lost_commands == 0
+    assert i2c.pipeline_fallbacks == 5
+    assert hw.devices[0x68] == {
+        0x10: 1,
+        0x11: 2,
+        0x12: 3,
+        0x13: 4,
+        0x20: 5,
+        0x21: 6,
+        0x22: 7,
+    }
+    # Reads lose commands and are repeated step by step
+    assert i2c.read(0x68, 0x13) == 4
+    assert hw.lost_commands > 0
+    assert i2c.pipeline_fallbacks == 6
+    assert i2c.pipeline_poll_words == 128
+    assert i2c.wait_statistics["backoff"] + i2c.wait_statistics["spin"] > 0
+
+
+def test_wait_for_transfer():
+    """Test the polling stages of waiting for an I2C command"""
+
+    i2c = MockI2C(None)
+    i2c.wait_timeout = 0.05
+    # Busy (TIP) status until the last sample
+    for sequence, stage in [
+        ([0x00], "immediate"),
+        ([0x02, 0x02, 0x00], "spin"),
+        ([0x02] * 8 + [0x00], "backoff"),
+    ]:
+        i2c.status_sequence = sequence
+        i2c.wait_for_transfer()
+        assert i2c.status_sequence == []
+        assert i2c.wait_statistics[stage] == 1
+    i2c.status_sequence = [0x02] * 100000
+    with pytest.raises(TimeoutError):
+        i2c.wait_for_transfer()
+    assert i2c.wait_statistics == {
+        "immediate": 1,
+        "spin": 1,
+        "backoff": 1,
+        "timeout": 1,
+    }
+
+
+def test_register_map():
+    """Test register map compiled from the firmware address table"""
+
+    register_map = TLUCONTROL.i2c.register_map
+    # The register map is compiled from the address table uhal uses
+    assert register_map.file_path == connection_address_table()
+    assert register_map.file_path.name.endswith("_26.xml")
+    TLUCONTROL.i2c.check_registers(tlu_registers)
+    with pytest.raises(KeyError):
+        connection_address_table(device_id="aida_tlu.udp")
+    assert register_map.address("triggerLogic.PostVetoTriggersR") == 0x7010
+    assert register_map["eventBuffer.EventFifoData"].mode == "non-incremental"
+    TLUCONTROL.i2c.check_registers(["Shutter.RunActiveRW", "version"])
+    with pytest.raises(KeyError):
+        TLUCONTROL.i2c.check_registers(["Shutter.RunActive"])
+    assert load_register_map(0x14).file_path.name.endswith("_14.xml")
+    assert load_register_map(0x20).file_path.name.endswith("_14.xml")
+    assert load_register_map(0x0).file_path.name.endswith("_26.xml")
+
+
+def test_fifo_readout():
+    """Test FIFO readout with the block read of the previously reported words"""
+
+    TLUCONTROL.reset_fifo()
+    if MOCK:
+        TLUCONTROL.i2c._queue_write("eventBuffer.EventFifoFillLevel", 12)
+        assert TLUCONTROL.pull_fifo_event() is None
+        assert TLUCONTROL._fifo_pending == 12
+        TLUCONTROL.i2c._queue_write("eventBuffer.EventFifoFillLevel", -1)
+        assert TLUCONTROL.pull_fifo_event() is None
+        assert TLUCONTROL._fifo_pending == 0
+    else:
+        TLUCONTROL.pull_fifo_event()
+        TLUCONTROL.pull_fifo_event()
+        assert TLUCONTROL._fifo_pending == 0
+
+
+def test_poll_scheduler():
+    """Test adapting the FIFO poll interval to the fill level"""
+
+    scheduler = PollScheduler(min_interval=0.0, max_interval=0.01, watermark=1000)
+    intervals = [scheduler.update(0) for _ in range(10)]
+    assert intervals == sorted(intervals)
+    assert intervals[-1] == 0.01
+    assert scheduler.update(500) == pytest.approx(0.005)
+    assert scheduler.update(2000) == 0.0
+    assert scheduler.update(-1) > 0.0
+    report = scheduler.get_report()
+    assert report["polls"] == 13
+    assert sum(report["histogram"]) == 13
+    with pytest.raises(ValueError):
+        PollScheduler(min_interval=0.1, max_interval=0.01)
+
+
+def test_event_framer():
+    """Test framing FIFO words into events across polls"""
+
+    words = np.arange(30, dtype=np.uint32)
+    words[0::6] = 0x10000001
+    framer = EventFramer()
+    events = [framer.frame(block) for block in np.split(words, [4, 5, 17])]
+    assert [event.shape for event in events] == [(0, 6), (0, 6), (2, 6), (3, 6)]
+    assert framer.n_remainder == 0
+    events = np.concatenate(events)
+    assert np.array_equal(events.ravel(), words)
+    assert np.array_equal(trigger_numbers(events), words[3::6])
+    assert event_timestamps(events)[0] == 25 * ((1 << 32) + 1)
+
+
+def test_event_batcher():
+    """Test sending framed events in batches"""
+
+    events = np.zeros((10, 6), dtype=np.uint32)
+    events[:, 1] = np.arange(10) * 40
+    events[:, 3] = np.arange(10)
+    batches = []
+    batcher = EventBatcher(batches.append, batch_size=4, batch_timeout=60)
+    batcher.add(events[:3])
+    assert batches == [] and batcher.n_pending == 3
+    batcher.add(events[3:9])
+    assert [batch.shape[0] for batch in batches] == [4, 4]
+    assert batcher.n_pending == 1
+    # The incomplete batch waits for the timeout unless it is forced
+    batcher.flush()
+    assert len(batches) == 2
+    batcher.batch_timeout = 0
+    batcher.flush()
+    assert len(batches) == 3 and batcher.n_pending == 0
+    batcher.batch_timeout = 60
+    batcher.add(events[9:])
+    batcher.flush(force=True)
+    assert batcher.n_batches == 4
+    assert np.array_equal(np.concatenate(batches), events)
+    with pytest.raises(ValueError):
+        EventBatcher(batches.append, batch_size=0)
+
+    meta = batch_metadata(batches[0])
+    assert meta == {
+        "flag_trigger": True,
+        "trigger_number": 0,
+        "timestamp_begin": 0,
+        "timestamp_end": 3 * 40 * 25000 + 25000,
+        "n_events": 4,
+        "trigger_numbers": [0, 1, 2, 3],
+        "timestamps": [0, 40 * 25000, 2 * 40 * 25000, 3 * 40 * 25000],
+    }
+    assert "n_events" not in batch_metadata(batches[3])
+    blocks = event_blocks(batches[0])
+    assert len(blocks) == 4 and all(len(block) == 24 for block in blocks)
+    assert np.frombuffer(blocks[1], dtype="<u4").tolist() == events[1].tolist()
+
+
+def test_resync_framer():
+    """Test resynchronizing a corrupted word stream"""
+
+    events = np.zeros((40, 6), dtype=np.uint32)
+    events[:, 1] = np.arange(40) * 400
+    events[:, 3] = np.arange(1, 41)
+    words = events.ravel()
+    # Inserted word after event 10, missing word of event 21 and garbage after event 30
+    corrupted = np.concatenate(
+        (words[:60], [99], words[60:120], words[121:180], np.zeros(14), words[180:])
+    )
+    for n_blocks in [1, 7]:
+        framer = ResyncFramer()
+        blocks = np.array_split(corrupted, n_blocks)
+        framed = [
+            framer.frame(block, final=index == n_blocks - 1)
+            for index, block in enumerate(blocks)
+        ]
+        assert framer.n_remainder == 0
+        assert np.array_equal(
+            np.concatenate([block[0] for block in framed]),
+            np.delete(events, 20, axis=0),
+        )
+        segments = np.concatenate([block[1] for block in framed])
+        assert segments.tolist() == [(60, 61), (121, 126), (180, 194)]
+        assert framer.n_quarantined_words == 20
+        assert framer.n_quarantined_segments == 3
+
+    # Corrupted words crossing the boundary of two blocks are reported as one segment
+    framer = ResyncFramer()
+    expected = framer.frame(corrupted, final=True)[1]
+    for split in range(1, corrupted.size):
+        framer = ResyncFramer()
+        first = framer.frame(corrupted[:split])[1]
+        second = framer.frame(corrupted[split:], final=True)[1]
+        assert np.array_equal(np.concatenate((first, second)), expected)
+        assert framer.n_quarantined_words == 20
+        assert framer.n_quarantined_segments == 3
+
+
+def test_status_sampler():
+    """Test caching of the TLU counter sample with a staleness bound"""
+
+    sampler = StatusSampler(TLUCONTROL.get_status, max_age=60)
+    status = sampler.get()
+    assert sampler.get() is status
+    assert sampler.n_samples == 1
+    assert sampler.sample() is not status
+    sampler.invalidate()
+    sampler.get()
+    assert sampler.n_samples == 3
+    sampler.max_age = 0
+    time.sleep(0.01)
+    sampler.get()
+    assert sampler.n_samples == 4
+
+
 def test_configuration():
     """Full test TLU configuration using test configuration file"""
 
@@ -101,5 +495,55 @@ def test_run():
         TLU.run()
 
 
+def test_run_readout_error(tmp_path):
+    """Test stopping the threads and closing the raw data file if the FIFO readout fails"""
+
+    if not MOCK:
+        pytest.skip("Requires a failing FIFO readout")
+    tlu = AidaTLU(
+        HW,
+        dict(CONFIG_FILE, output_data_path=str(tmp_path)),
+        FILEPATH / "../misc/aida_tlu_clk_config.txt",
+        i2c=I2CMETHOD,
+    )
+    tlu.configure()
+
+    def _pull_fifo_event():
+        raise OSError("FIFO read failed")
+
+    tlu.tlu_controller.pull_fifo_event = _pull_fifo_event
+    with pytest.raises(OSError):
+        tlu.run()
+    threads = [thread.name for thread in threading.enumerate()]
+    assert "DataWriter" not in threads
+    assert "Status" not in threads
+    assert not tlu.h5_file.isopen
+
+
+def test_run_interpretation_queue(tmp_path):
+    """Test interpreting the data of a run in the background worker processes"""
+
+    if not MOCK:
+        pytest.skip("Requires a mocked timestamp")
+    tlu = AidaTLU(
+        HW,
+        dict(CONFIG_FILE, output_data_path=str(tmp_path), timeout=1),
+        FILEPATH / "../misc/aida_tlu_clk_config.txt",
+        i2c=I2CMETHOD,
+        interpretation_workers=CONFIG_FILE["interpretation_workers"] + 1,
+    )
+    tlu.configure()
+    start_time = time.time()
+    tlu.tlu_controller.get_timestamp = lambda: (
+        (time.time() - start_time) / 25 * 1000000000
+    )
+    tlu.tlu_controller.pull_fifo_event = lambda: 0
+    tlu.run()
+    tlu.close()
+    assert tlu.interpretation_queue.n_pending == 0
+    assert tlu.interpretation_queue.status(0) == "done"
+    assert tlu.interpretation_queue.jobs[0].filepath_in == tlu.raw_data_path
+
+
 if __name__ == "__main__":
     pytest.main()
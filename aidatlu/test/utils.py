@@ -1,17 +1,48 @@
+import time
 import yaml
 from pathlib import Path
+from types import SimpleNamespace
 from aidatlu import logger
-from aidatlu.hardware.i2c import I2CCore, i2c_addr
+from aidatlu.hardware.i2c import I2CCore, i2c_addr, i2c_core_clock, ipbus_word_time
 
 FILEPATH = Path(__file__).parent
 
 
+class MockWord:
+    """Mocks the uhal ValWord returned by register reads, the value is always valid."""
+
+    def __init__(self, value: int) -> None:
+        self._value = value
+
+    def valid(self) -> bool:
+        return True
+
+    def value(self) -> int:
+        return self._value
+
+
+class MockVector(list):
+    """Mocks the uhal ValVector returned by block reads, the words are always valid."""
+
+    def valid(self) -> bool:
+        return True
+
+    def size(self) -> int:
+        return len(self)
+
+
 class MockI2C(I2CCore):
     """Class mocking the I2C interface and replacing the hardware with register dictionaries for testing."""
 
-    def __init__(self, hw_int) -> None:  # noqa
+    def __init__(self, hw_int) -> None:
+        super().__init__(hw_int)
         with open(FILEPATH / "register_table.yaml", "r") as yaml_file:
             self.reg_table = yaml.safe_load(yaml_file)
+        self._compile_register_table()
+        # Start of the mock run, the timestamp runs while a run is active
+        self._run_start = None
+        # Values returned by the next reads of the I2C status register
+        self.status_sequence = []
         self.i2c_device_table = {
             0x21: {},
             0x68: {},  # Si5345
@@ -29,7 +60,7 @@ class MockI2C(I2CCore):
         self.log = logger.setup_derived_logger("I2CCore")
         self.modules = i2c_addr  # Use I2C device name to address translation
 
-    def init(self):
+    def init(self, full_scan: bool = False, cache_file: str | None = None):
         self.log.info("Initializing Mock I2C")
         self.set_i2c_clock_prescale(0x30)
         self.set_i2c_control(0x80)
@@ -44,52 +75,231 @@ class MockI2C(I2CCore):
         self.set_i2c_tx(0x0)
         self.set_i2c_command(0x50)
 
+    def probe(self, addresses: list) -> list:
+        """Mock I2C address probe, all devices of the device table acknowledge"""
+        return [addr for addr in addresses if addr in self.i2c_device_table]
+
     def write(self, device_addr: int, mem_addr: int, value: int) -> None:
         """Mock I2C device memory write"""
+        mem_addr = self._mock_address(device_addr, mem_addr)
         self.i2c_device_table[device_addr][mem_addr] = value
 
     def write_array(self, device_addr: int, mem_addr: int, values: list) -> None:
         """Mock I2C device memory array write"""
-        self.i2c_device_table[device_addr][mem_addr] = values
+        if device_addr == self.modules["clk"]:
+            # The Si5345 increments the register address after each byte
+            for index, value in enumerate(values):
+                self.write(device_addr, mem_addr + index, value)
+        else:
+            self.i2c_device_table[device_addr][mem_addr] = values
 
     def read(self, device_addr: int, mem_addr: int) -> int:
         """Mock I2C memory read"""
+        mem_addr = self._mock_address(device_addr, mem_addr)
         try:
             return self.i2c_device_table[device_addr][mem_addr]
         except KeyError:
             self.i2c_device_table[device_addr][mem_addr] = -1
             return self.i2c_device_table[device_addr][mem_addr]
 
-    def write_register(self, register: str, value: int) -> None:
+    def _mock_address(self, device_addr: int, mem_addr: int) -> int:
+        """Si5345 registers are paged, the page is selected by writing register 0x01"""
+        if device_addr != self.modules["clk"] or mem_addr & 0xFF == 0x01:
+            return mem_addr
+        page = self.i2c_device_table[device_addr].get(0x01, 0) & 0xFF
+        return (page << 8) | (mem_addr & 0xFF)
+
+    def dispatch(self) -> None:
+        """Mock IPbus dispatch, register accesses are executed immediately"""
+
+    def _queue_write(self, register: str, value: int) -> None:
         """Mock IPbus register write"""
-        reg_adressing = register.split(".")
-        if len(reg_adressing) == 2:
-            self.reg_table[reg_adressing[0]][reg_adressing[1]]["value"] = value
-        elif len(reg_adressing) == 1:
-            self.reg_table[register]["value"] = value
-        else:
-            raise ValueError("Invalid register addressing")
+        self._entries[register]["value"] = value
+        if register == "Shutter.RunActiveRW":
+            self._run_start = time.time() if value == 1 else None
 
-    def read_register(self, register: str) -> int:
+    def _queue_read(self, register: str) -> MockWord:
         """Mock IPbus register read"""
-        # Read register does not have the same value as the write register for the mock
-        register_read_write = register[:-1] + register[-1].replace("R", "W")
-        if register == "eventBuffer.EventFifoCSR":
-            register_read_write = register
-        reg_adressing = register.split(".")
-        reg_adressing_read_write = register_read_write.split(".")
-        try:
-            if len(reg_adressing) == 2:
-                return self.reg_table[reg_adressing_read_write[0]][
-                    reg_adressing_read_write[1]
-                ]["value"]
-            if len(reg_adressing) == 1:
-                return self.reg_table[reg_adressing_read_write[0]]["value"]
-            raise ValueError("Invalid register addressing")
-        except KeyError:
-            if len(reg_adressing) == 2:
-                self.reg_table[reg_adressing[0]][reg_adressing[1]]["value"] = -1
-                return self.reg_table[reg_adressing[0]][reg_adressing[1]]["value"]
-            if len(reg_adressing) == 1:
-                self.reg_table[reg_adressing[0]]["value"] = -1
-                return self.reg_table[reg_adressing[0]]["value"]
+        return MockWord(self._read_mock_register(register))
+
+    def _queue_read_block(self, register: str, n_words: int) -> MockVector:
+        """Mock IPbus block read, there is no data in the mock FIFO"""
+        return MockVector()
+
+    def _read_mock_register(self, register: str) -> int:
+        if register == "i2c_master.i2c_cmdstatus" and self.status_sequence:
+            return self.status_sequence.pop(0)
+        if self._run_start is not None and register in [
+            "Event_Formatter.CurrentTimestampHR",
+            "Event_Formatter.CurrentTimestampLR",
+        ]:
+            # Timestamp in 40MHz clock cycles since the start of the run
+            timestamp = int((time.time() - self._run_start) * 40e6)
+            if register.endswith("HR"):
+                return timestamp >> 32
+            return timestamp & 0xFFFFFFFF
+        write_entry, entry = self._aliases[register]
+        if write_entry is not None and "value" in write_entry:
+            return write_entry["value"]
+        entry["value"] = -1
+        return entry["value"]
+
+    def _compile_register_table(self) -> None:
+        """Resolves the register names of the register table once.
+        Read registers do not have the same value as the write registers for the mock,
+        each register is paired with the entry of its write register.
+        """
+        self._entries = {}
+        for group_name, group in self.reg_table.items():
+            if "permission" in group:
+                self._entries[group_name] = group
+                continue
+            for name, entry in group.items():
+                if isinstance(entry, dict):
+                    self._entries[group_name + "." + name] = entry
+        self._aliases = {}
+        for register, entry in self._entries.items():
+            register_read_write = register[:-1] + register[-1].replace("R", "W")
+            if register == "eventBuffer.EventFifoCSR":
+                register_read_write = register
+            self._aliases[register] = (self._entries.get(register_read_write), entry)
+
+
+# Stand-in for the uhal block read modes if uhal is not installed
+FAKE_UHAL = SimpleNamespace(
+    BlockReadWriteMode=SimpleNamespace(NON_INCREMENTAL="non-incremental")
+)
+
+
+class FakeWord:
+    """uhal ValWord of the fake hardware, the value is only valid after dispatch."""
+
+    def __init__(self) -> None:
+        self._value = None
+
+    def valid(self) -> bool:
+        return self._value is not None
+
+    def value(self) -> int:
+        return self._value
+
+
+class FakeVector(MockVector):
+    """uhal ValVector of the fake hardware, the words are only valid after dispatch."""
+
+    dispatched = False
+
+    def valid(self) -> bool:
+        return self.dispatched
+
+
+class FakeNode:
+    """uhal node of a single I2C master register of the fake hardware."""
+
+    def __init__(self, hw, register: str) -> None:
+        self.hw = hw
+        self.register = register
+
+    def getAddress(self) -> str:
+        return self.register
+
+    def write(self, value: int) -> None:
+        self.hw.queue(lambda: self.hw.write(self.register, value))
+
+    def read(self) -> FakeWord:
+        word = FakeWord()
+        self.hw.queue(lambda: setattr(word, "_value", self.hw.read(self.register)))
+        return word
+
+
+class FakeI2CHardware:
+    """Fakes the IPbus interface of the TLU with a model of the OpenCores I2C master and I2C devices.
+    Queued accesses are executed back to back on dispatch, each takes one IPbus word time.
+    Every command keeps the master busy (TIP) for nine SCL periods, commands written while
+    the master is busy are lost as on the hardware. The devices auto-increment the memory address after each byte.
+    All other registers are plain memory, identified by the last part of the node name.
+    """
+
+    def __init__(self, devices: list) -> None:
+        self.devices = {addr: {} for addr in devices}
+        self.registers = {"i2c_pre_lo": 0xFF, "i2c_pre_hi": 0xFF, "i2c_ctrl": 0}
+        self.rxtx = 0
+        self.ack = False
+        self.busy_until = 0
+        self.lost_commands = 0
+        self.n_dispatches = 0
+        self._device = None
+        self._pointer = None
+        self._queue = []
+        # Time in IPbus word accesses, it also passes between dispatches
+        self.now = 0
+        self._start = time.perf_counter()
+
+    def getNode(self, register: str) -> FakeNode:
+        return FakeNode(self, register.split(".")[-1])
+
+    def getClient(self):
+        return self
+
+    def queue(self, access) -> None:
+        self._queue.append(access)
+
+    def dispatch(self) -> None:
+        elapsed = (time.perf_counter() - self._start) / ipbus_word_time
+        self.now = max(self.now, int(elapsed))
+        queue, self._queue = self._queue, []
+        if queue:
+            self.n_dispatches += 1
+        for access in queue:
+            access()
+
+    def readBlock(self, register: str, n_words: int, mode) -> FakeVector:
+        vector = FakeVector()
+
+        def access():
+            vector.extend(self.read(register) for _ in range(n_words))
+            vector.dispatched = True
+
+        self.queue(access)
+        return vector
+
+    def read(self, register: str) -> int:
+        self.now += 1
+        if register == "i2c_cmdstatus":
+            return (int(not self.ack) << 7) | (int(self.now < self.busy_until) << 1)
+        if register == "i2c_rxtx":
+            return self.rxtx
+        return self.registers.get(register, 0)
+
+    def write(self, register: str, value: int) -> None:
+        self.now += 1
+        if register == "i2c_cmdstatus":
+            if self.now < self.busy_until:
+                self.lost_commands += 1
+            else:
+                self._command(value)
+        elif register == "i2c_rxtx":
+            self.rxtx = value
+        else:
+            self.registers[register] = value
+
+    def _command(self, command: int) -> None:
+        prescale = (self.registers["i2c_pre_hi"] << 8) | self.registers["i2c_pre_lo"]
+        bit_time = 5 * (prescale + 1) / i2c_core_clock
+        self.busy_until = self.now + round(9 * bit_time / ipbus_word_time)
+        if command & 0x80:  # Start
+            self._device = self.rxtx >> 1
+            if not self.rxtx & 0x1:
+                self._pointer = None
+            self.ack = self._device in self.devices
+        elif command & 0x10 and self._device in self.devices:  # Write
+            if self._pointer is None:
+                self._pointer = self.rxtx
+            else:
+                self.devices[self._device][self._pointer] = self.rxtx
+                self._pointer += 1
+        elif command & 0x20 and self._device in self.devices:  # Read
+            self.rxtx = self.devices[self._device].get(self._pointer, 0)
+            self._pointer += 1
+        if command & 0x40:  # Stop
+            self._device = None